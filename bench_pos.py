@@ -0,0 +1,221 @@
+"""Microbenchmarks for the POS hot paths on synthetic data.
+
+Builds a throwaway shop (catalogs plus months of sales, debts and MedGulf
+ledgers) in a temporary directory, times the hot paths through the Flask test
+client and writes the timings to a JSON file so runs can be compared:
+
+    python bench_pos.py --skus 10000 --sales-rows 100000 --output before.json
+    python bench_pos.py --skus 10000 --sales-rows 100000 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORDS = ['Brake', 'Pad', 'Chain', 'Sprocket', 'Filter', 'Clutch', 'Cable', 'Mirror', 'Lever', 'Bulb',
+         'Spark', 'Plug', 'Gasket', 'Bearing', 'Seal', 'Piston', 'Ring', 'Valve', 'فلتر', 'زيت', 'إطار', 'سلسلة']
+
+
+# --------------------------
+# Synthetic data
+# --------------------------
+def write_rows(path, headers, rows):
+    """Write a single-sheet workbook in write-only mode (fast for large files)"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(headers)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+def catalog_names(count, rng):
+    return [f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i:05d}" for i in range(count)]
+
+def generate_catalogs(pos, skus, rng):
+    names = {}
+    for file_path, count in ((pos.PRODUCT_FILE, skus), (pos.OIL_FILE, max(skus // 50, 10)), (pos.WHEEL_FILE, max(skus // 50, 10))):
+        names[file_path] = catalog_names(count, rng)
+        rows = ([n, round(rng.uniform(1, 50), 2), round(rng.uniform(60, 200), 2), rng.randint(100000, 1000000)]
+                for n in names[file_path])
+        write_rows(file_path, pos.CATALOG_HEADERS[file_path], rows)
+    return names
+
+def generate_ledgers(pos, sales_rows, months, names, rng):
+    """Spread sales rows over the last `months` months; debts and MedGulf get a tenth each"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    first = (today.replace(day=1) - timedelta(days=31 * (months - 1))).replace(day=1)
+    days = [first + timedelta(days=i) for i in range((today - first).days + 1)]
+    products = names[pos.PRODUCT_FILE]
+    customers = [f"Customer {i}" for i in range(200)]
+    current_month = today.strftime('%Y-%m')
+
+    def place(file_name, key):
+        return file_name if key[:7] == current_month else os.path.join(pos.ARCHIVE_DIR, file_name)
+
+    def receipt_rows(day, count, with_customer):
+        step = 86400 / max(count, 1)
+        for i in range(count):
+            qty = rng.randint(1, 4)
+            price = round(rng.uniform(5, 200), 2)
+            row = [rng.choice(products), price, qty, round(price * qty, 2),
+                   (day + timedelta(seconds=int(i * step))).strftime('%Y-%m-%d %H:%M:%S'), f"R{day:%Y%m%d}{i:06d}"]
+            yield [rng.choice(customers)] + row if with_customer else row
+
+    per_day = sales_rows // len(days)
+    for day in days:
+        key = day.strftime('%Y-%m-%d')
+        write_rows(place(pos.ledger_file('sales', key), key), pos.SALES_HEADERS, receipt_rows(day, per_day, False))
+    for ledger in ('debts', 'medgulf'):
+        by_month = {}
+        for day in days:
+            by_month.setdefault(day.strftime('%Y-%m'), []).append(day)
+        for month, month_days in by_month.items():
+            rows = (r for day in month_days for r in receipt_rows(day, max(per_day // 10, 1), True))
+            write_rows(place(pos.ledger_file(ledger, month), month), pos.MONTHLY_HEADERS, rows)
+    return per_day * len(days)
+
+
+# --------------------------
+# Timing
+# --------------------------
+def summarize(samples):
+    ms = [s * 1000 for s in samples]
+    return {'runs': len(ms), 'min_ms': round(min(ms), 3), 'median_ms': round(statistics.median(ms), 3),
+            'mean_ms': round(statistics.mean(ms), 3), 'max_ms': round(max(ms), 3)}
+
+def bench(results, name, fn, repeat, setup=None):
+    """Time fn() `repeat` times (setup() runs untimed before each call)"""
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    results[name] = summarize(samples)
+    print(f"{name:28s} median {results[name]['median_ms']:10.2f} ms   min {results[name]['min_ms']:10.2f} ms")
+
+def check(response, expected=(200, 302)):
+    if response.status_code not in expected:
+        raise RuntimeError(f"unexpected status {response.status_code}")
+    return response
+
+def run(pos, names, repeat):
+    client = pos.app.test_client()
+    check(client.post('/', data={'username': 'admin', 'password': 'admin123'}))
+    products = names[pos.PRODUCT_FILE]
+    rng = random.Random(1)
+    results = {}
+
+    def add_product():
+        check(client.post('/pos', data={'action': 'add_product', 'product_name': rng.choice(products), 'quantity': '1'}))
+
+    bench(results, 'pos_get', lambda: check(client.get('/pos')), repeat)
+    bench(results, 'add_product', add_product, repeat)
+    bench(results, 'api_add_product', lambda: check(client.post('/api/cart', json={
+        'action': 'add_product', 'product_name': rng.choice(products), 'quantity': 1})), repeat)
+    for action, customer in (('finalize_cash', ''), ('finalize_credit', 'Customer 1'), ('finalize_medgulf', 'Customer 2')):
+        bench(results, action, lambda a=action, c=customer: check(client.post('/pos', data={'action': a, 'customer_name': c})),
+              repeat, setup=add_product)
+    bench(results, 'inventory_search', lambda: check(client.get('/inventory', query_string={'q': rng.choice(WORDS)})), repeat)
+    bench(results, 'api_catalog_search', lambda: check(client.get('/api/catalog/search', query_string={
+        'q': rng.choice(WORDS)[:3]})), repeat)
+    bench(results, 'ledger_rows_month', lambda: pos.storage.ledger_rows('sales', datetime.now().strftime('%Y-%m')), repeat)
+    bench(results, 'daily_report', pos.generate_daily_word_report, repeat)
+    bench(results, 'debts_report', pos.generate_debts_word_report, repeat)
+    bench(results, 'medgulf_report', pos.generate_medgulf_word_report, repeat)
+    year = str(datetime.now().year)
+    bench(results, 'yearly_debts_report', lambda: pos.generate_yearly_word_report('debts', year), repeat)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare(results, baseline_file):
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    print(f"\n{'benchmark':28s} {'baseline':>12s} {'now':>12s} {'change':>9s}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = (now['median_ms'] / before['median_ms'] - 1) * 100 if before['median_ms'] else 0.0
+        print(f"{name:28s} {before['median_ms']:10.2f}ms {now['median_ms']:10.2f}ms {change:+8.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--skus', type=int, default=10000, help='products in the catalog (oils/wheels get 1/50th)')
+    parser.add_argument('--sales-rows', type=int, default=100000, help='cash sales rows across all months')
+    parser.add_argument('--months', type=int, default=3, help='months of ledgers, the current one included')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--backend', choices=['xlsx', 'sqlite'], default='xlsx')
+    parser.add_argument('--output', default='bench_results.json', help='results file (JSON)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--keep', action='store_true', help='keep the generated shop directory')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = tempfile.mkdtemp(prefix='pos-bench-')
+    os.chdir(workdir)
+    os.symlink(os.path.join(HERE, 'templates'), 'templates')
+    os.environ['POS_STORAGE'] = args.backend
+    sys.path.insert(0, HERE)
+    import pos_app as pos
+    pos.app.root_path = workdir  # reports are sent from the bench directory
+    os.makedirs(pos.ARCHIVE_DIR, exist_ok=True)
+    os.makedirs(pos.REPORTS_DIR, exist_ok=True)
+
+    rng = random.Random(42)
+    start = time.perf_counter()
+    names = generate_catalogs(pos, args.skus, rng)
+    rows = generate_ledgers(pos, args.sales_rows, args.months, names, rng)
+    pos.write_sheet(pos.USER_FILE, pos.USER_HEADERS, pos.DEFAULT_USERS)
+    if args.backend == 'sqlite':
+        pos.migrate_xlsx_to_sqlite(pos.SQLITE_FILE)
+    pos.storage.ensure()
+    print(f"Generated {args.skus} SKUs and {rows} sales rows in {time.perf_counter() - start:.1f}s ({workdir})")
+
+    try:
+        results = run(pos, names, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'skus': args.skus,
+            'sales_rows': rows,
+            'months': args.months,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    if baseline:
+        compare(results, baseline)
+
+if __name__ == '__main__':
+    main()
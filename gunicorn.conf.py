@@ -0,0 +1,6 @@
+# Read by gunicorn from the working directory (see procfile.txt and render.yaml).
+
+def on_starting(server):
+    """Create missing data files and build the dashboard aggregates before any worker serves a request"""
+    from pos_app import maintenance
+    maintenance.prepare()
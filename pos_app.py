@@ -1,9 +1,34 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
-from openpyxl import load_workbook, Workbook
-from datetime import datetime
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify, Response, stream_with_context, g, has_request_context
+from openpyxl import load_workbook as _openpyxl_load_workbook, Workbook
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import os
+import io
+import csv
+import itertools
+import re
+import json
+import math
+import mmap
+import multiprocessing
+import hashlib
 import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import uuid
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
 from docx import Document
+from docx.oxml import parse_xml
+from xml.sax.saxutils import escape as xml_escape
 
 app = Flask(__name__, template_folder='templates')
 app.secret_key = 'change_this_to_a_secure_random_value'  # change for production
@@ -15,301 +40,1904 @@ def inject_datetime():
 # === Files ===
 USER_FILE = 'users.xlsx'
 PRODUCT_FILE = 'products.xlsx'
-SALES_FILE = 'sales_log.xlsx'
+SALES_FILE = 'sales_log.xlsx'  # pre-partitioning single sales log, split up by ensure_files
+SALES_FILE_PREFIX = 'sales_'
 OIL_FILE = 'oils.xlsx'
 WHEEL_FILE = 'wheels.xlsx'
 CREDIT_FILE_PREFIX = 'debts_'
 MEDGULF_FILE_PREFIX = 'medgulf_'
 REPORTS_DIR = 'reports'
 ARCHIVE_DIR = 'archive'
+LOCK_DIR = 'locks'
+SALES_JOURNAL = os.environ.get('POS_SALES_JOURNAL', '1') == '1'  # cash sales go to an append-only journal
+JOURNAL_COMPACT_BYTES = 256 * 1024  # journal size at which it is folded into the xlsx ledger
+DASHBOARD_FILE = 'dashboard.json'
+REPORT_JOBS_DIR = os.path.join(REPORTS_DIR, 'jobs')
+REPORT_JOB_WORKERS = 2  # report builds running at once per gunicorn worker
+REPORT_JOB_HEARTBEAT = 10  # seconds between heartbeats of a worker's queued and running jobs
+REPORT_JOB_STALE = 60  # a queued or running job without a heartbeat for this long is dead
+REPORT_JOB_KEEP = 6 * 3600  # seconds a finished (or dead) job stays downloadable before it is pruned
+STOCK_WAL_FILE = 'stock_wal.jsonl'
+WAL_SNAPSHOT_EVERY = 200  # stock changes in the WAL after which maintenance writes them back to the xlsx files
+HISTORY_CACHE_DIR = os.path.join(ARCHIVE_DIR, '.columns')  # columnar sidecars of archived partitions
+HISTORY_WORKERS = int(os.environ.get('POS_HISTORY_WORKERS', os.cpu_count() or 1))  # processes parsing archives
+CART_FILE = os.environ.get('POS_CART_FILE', 'carts.db')  # open carts, shared by all workers
+CART_TTL = int(os.environ.get('POS_CART_TTL', 12 * 3600))  # seconds before an untouched cart is evicted
+HOLD_TTL = int(os.environ.get('POS_HOLD_TTL', 30 * 60))  # seconds a cart's stock holds outlive its last change
+CATALOG_PAGE_SIZE = 24  # catalog items per search page
+CATALOG_PAGE_MAX = 100
+METRICS_DIR = 'metrics'  # per-worker metric dumps merged by /metrics
+METRICS_FLUSH_SECONDS = 5
+METRICS_RETIRED_FILE = os.path.join(METRICS_DIR, 'retired.json')  # folded dumps of workers that stopped writing
+METRICS_STALE_SECONDS = 15 * 60  # a dump not rewritten for this long is folded into METRICS_RETIRED_FILE
+METRICS_TOKEN = os.environ.get('POS_METRICS_TOKEN')  # lets a scraper read /metrics without a login
+CHANGE_BUS = os.environ.get('POS_CHANGE_BUS', 'local')  # how workers tell each other about data changes
+CHANGE_FILE = 'data_version.bin'  # shared topic versions of the local change bus
+CHANGE_RECHECK_SECONDS = 2  # in-process caches recheck the files at least this often
+DAILY_UNITS_DIR = 'daily_units'  # per-item units sold, one JSON file per day
+VELOCITY_DAYS = 180  # days of per-item units kept for sales velocity
+REORDER_WINDOW_DAYS = 30  # default sales window of the reorder report
+REORDER_LEAD_DAYS = 14  # flag items with less cover than this
+REORDER_TARGET_DAYS = 30  # suggested orders top stock up to this many days of sales
+MAINTENANCE_FILE = 'maintenance.json'  # last slot each maintenance task ran for
+MAINTENANCE_ENABLED = os.environ.get('POS_MAINTENANCE', '1') == '1'  # 0: run `flask maintenance` from cron instead
+MAINTENANCE_POLL_SECONDS = 60
+MAINTENANCE_GRACE = timedelta(hours=1)  # how late end-of-day reports may still be built
+MAINTENANCE_TIMES = {  # HH:MM, local time
+    'rollover': '23:50',  # create tomorrow's partitions
+    'archive': '00:10',  # move past months' partitions to ARCHIVE_DIR
+    'compact': '03:00',  # fold sales journals into their workbooks
+    'jobs': '03:30',  # prune finished and dead report jobs
+    'reports': os.environ.get('POS_REPORTS_AT', '23:55'),  # pre-generate daily/debts/MedGulf reports
+}
+
+# === Storage backend ===
+STORAGE_BACKEND = os.environ.get('POS_STORAGE', 'xlsx')  # 'xlsx' (default) or 'sqlite'
+SQLITE_FILE = os.environ.get('POS_SQLITE_FILE', 'pos.db')
+
+# === Sheet layouts ===
+USER_HEADERS = ['Username', 'Password', 'Role']
+DEFAULT_USERS = [('admin', 'admin123', 'admin'), ('cashier', '1234', 'cashier')]
+CATALOG_HEADERS = {
+    PRODUCT_FILE: ['Product', 'Buy Price', 'Sell Price', 'Stock'],
+    OIL_FILE: ['Oil', 'Buy Price', 'Sell Price', 'Stock'],
+    WHEEL_FILE: ['Wheel', 'Buy Price', 'Sell Price', 'Stock'],
+}
+CATALOG_KINDS = {PRODUCT_FILE: 'product', OIL_FILE: 'oil', WHEEL_FILE: 'wheel'}
+CATALOG_FILES = {kind: file_path for file_path, kind in CATALOG_KINDS.items()}
+SALES_HEADERS = ['Product', 'Price', 'Quantity', 'Total', 'DateTime', 'ReceiptID']
+MONTHLY_HEADERS = ['Customer Name', 'Product', 'Price', 'Quantity', 'Total', 'DateTime', 'ReceiptID']
+
+# === Ledger partitions ===
+# Cash sales are kept in one file per day, debts and MedGulf in one per month.
+LEDGER_PREFIXES = {'sales': SALES_FILE_PREFIX, 'debts': CREDIT_FILE_PREFIX, 'medgulf': MEDGULF_FILE_PREFIX}
+LEDGER_HEADERS = {'sales': SALES_HEADERS, 'debts': MONTHLY_HEADERS, 'medgulf': MONTHLY_HEADERS}
+PARTITION_KEY_LEN = {'sales': len('YYYY-MM-DD'), 'debts': len('YYYY-MM'), 'medgulf': len('YYYY-MM')}
+PAYMENT_TYPES = {'sales': 'cash', 'debts': 'credit', 'medgulf': 'medgulf'}
+
+# --------------------------
+# Metrics
+# --------------------------
+# Per-worker counters and histograms, exposed in Prometheus text format at
+# /metrics. Each worker periodically dumps its numbers to METRICS_DIR and
+# /metrics adds up the dumps. Dumps that went stale (the worker exited or sat
+# idle) are folded into METRICS_RETIRED_FILE and removed, so the directory
+# stays small. A worker whose dump was folded subtracts what it had written
+# and carries on from there, so nothing is counted twice.
+METRIC_TYPES = {
+    'pos_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'pos_request_duration_seconds': ('histogram', 'Request latency by route'),
+    'pos_request_workbook_ops': ('histogram', 'Workbook loads and saves per request, by route'),
+    'pos_file_ops_total': ('counter', 'Workbook loads/saves and journal appends by file'),
+    'pos_file_bytes_total': ('counter', 'Bytes read and written by file'),
+    'pos_report_build_seconds': ('histogram', 'Report generation time by report kind'),
+}
+METRIC_BUCKETS = {
+    'pos_request_duration_seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'pos_request_workbook_ops': (0, 1, 2, 5, 10, 25, 50),
+    'pos_report_build_seconds': (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+}
+
+class Metrics:
+    """Counters and cumulative-bucket histograms keyed by (metric name, label pairs)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}  # key -> [count per bucket..., +Inf count, sum]
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRIC_BUCKETS[name]
+        with self._lock:
+            h = self.histograms.setdefault(key, [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += 1
+            h[-1] += value
+
+    def dump(self):
+        with self._lock:
+            return {'counters': [[n, l, v] for (n, l), v in self.counters.items()],
+                    'histograms': [[n, l, h] for (n, l), h in self.histograms.items()]}
+
+    def merge(self, dump, sign=1):
+        """Add a dump's numbers in (sign=-1 takes them out)"""
+        with self._lock:
+            for name, labels, value in dump['counters']:
+                key = (name, tuple(tuple(p) for p in labels))
+                self.counters[key] = self.counters.get(key, 0) + sign * value
+            for name, labels, values in dump['histograms']:
+                key = (name, tuple(tuple(p) for p in labels))
+                h = self.histograms.setdefault(key, [0] * len(values))
+                for i, v in enumerate(values):
+                    h[i] += sign * v
+
+    def render(self):
+        """Prometheus text exposition format"""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+        lines = []
+        for name, (kind, help_text) in METRIC_TYPES.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == 'counter':
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{fmt(labels)} {value}")
+                continue
+            for (n, labels), h in sorted(self.histograms.items()):
+                if n != name:
+                    continue
+                for bound, count in zip(METRIC_BUCKETS[name], h):
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {h[-2]}")
+                lines.append(f"{name}_sum{fmt(labels)} {h[-1]}")
+                lines.append(f"{name}_count{fmt(labels)} {h[-2]}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+_metrics_file = None  # named on first flush, in the worker process (not a --preload master)
+_metrics_pid = None
+_metrics_written = None  # the dump last written to _metrics_file
+_metrics_flushed = 0.0
+
+def flush_metrics(force=False):
+    """Dump this worker's metrics for /metrics, at most every METRICS_FLUSH_SECONDS"""
+    global _metrics_file, _metrics_pid, _metrics_written, _metrics_flushed
+    now = time.time()
+    if not force and now - _metrics_flushed < METRICS_FLUSH_SECONDS:
+        return
+    _metrics_flushed = now
+    if _metrics_pid != os.getpid():
+        _metrics_pid = os.getpid()
+        _metrics_file = os.path.join(METRICS_DIR, f"{_metrics_pid}-{int(now)}.json")
+        _metrics_written = None
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with file_lock(METRICS_RETIRED_FILE):
+        if _metrics_written is not None and not os.path.exists(_metrics_file):
+            metrics.merge(_metrics_written, sign=-1)  # already counted in METRICS_RETIRED_FILE
+        dump = metrics.dump()
+        write_json(_metrics_file, dump)
+        _metrics_written = dump
+
+def merged_metrics():
+    """Every worker's metrics added up; stale dumps are folded into METRICS_RETIRED_FILE on the way"""
+    merged, retired = Metrics(), Metrics()
+    now = time.time()
+    with file_lock(METRICS_RETIRED_FILE):
+        if os.path.exists(METRICS_RETIRED_FILE):
+            retired.merge(_load_json(METRICS_RETIRED_FILE))
+        stale = []
+        for name in os.listdir(METRICS_DIR):
+            path = os.path.join(METRICS_DIR, name)
+            if not name.endswith('.json') or path == METRICS_RETIRED_FILE:
+                continue
+            dump = _load_json(path)
+            if now - os.path.getmtime(path) > METRICS_STALE_SECONDS:
+                retired.merge(dump)
+                stale.append(path)
+            else:
+                merged.merge(dump)
+        if stale:
+            write_json(METRICS_RETIRED_FILE, retired.dump())
+            for path in stale:
+                os.remove(path)
+    merged.merge(retired.dump())
+    return merged
+
+def metric_file_label(file_path):
+    """File label for I/O metrics; dates in partition and report names are folded so labels stay few"""
+    name = re.sub(r'\d{4}-\d{2}(-\d{2})?', '*', os.path.basename(str(file_path)))
+    folder = os.path.dirname(os.path.normpath(str(file_path)))
+    return os.path.join(folder, name) if folder else name
+
+def record_io(op, file_path, nbytes=None):
+    """Count a file operation ('load', 'save' or 'append') and its bytes"""
+    label = metric_file_label(file_path)
+    metrics.inc('pos_file_ops_total', {'op': op, 'file': label})
+    if nbytes:
+        direction = 'read' if op == 'load' else 'written'
+        metrics.inc('pos_file_bytes_total', {'direction': direction, 'file': label}, nbytes)
+    if has_request_context() and op in ('load', 'save'):
+        g.workbook_ops[op] = g.workbook_ops.get(op, 0) + 1
+
+def load_workbook(filename, **kwargs):
+    """openpyxl's load_workbook, counted in the I/O metrics"""
+    if isinstance(filename, (str, os.PathLike)):
+        record_io('load', filename, file_signature(filename)[1] if os.path.exists(filename) else None)
+    else:
+        record_io('load', 'upload')
+    return _openpyxl_load_workbook(filename, **kwargs)
+
+@app.before_request
+def _start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.workbook_ops = {}
+
+@app.after_request
+def _record_request_metrics(response):
+    route = request.endpoint or 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe('pos_request_duration_seconds', {'route': route, 'method': request.method},
+                        time.perf_counter() - started)
+    metrics.inc('pos_requests_total', {'route': route, 'method': request.method, 'status': str(response.status_code)})
+    ops = g.get('workbook_ops') or {}
+    for op in ('load', 'save'):
+        metrics.observe('pos_request_workbook_ops', {'route': route, 'op': op}, ops.get(op, 0))
+    try:
+        flush_metrics()
+    except Exception:
+        app.logger.exception('Could not write metrics')
+    return response
 
 # --------------------------
 # Helpers & file initialization
 # --------------------------
+_held_locks = threading.local()
+_thread_locks = {}  # lock path -> [threading.Lock serializing this process's threads, users]
+_thread_locks_guard = threading.Lock()
+
+def _lock_path(file_path):
+    return os.path.join(LOCK_DIR, os.path.normpath(file_path).replace(os.sep, '__') + '.lock')
+
+@contextmanager
+def file_lock(file_path):
+    """Exclusive lock on a data file, shared by all threads and gunicorn workers.
+
+    The lock is taken on a sidecar file in LOCK_DIR (the data file itself is
+    swapped out by save_workbook) and is re-entrant within a thread. Threads of
+    this process first queue on an in-process lock, which is all there is
+    where fcntl is missing.
+    """
+    lock_path = _lock_path(file_path)
+    held = _held_locks.__dict__.setdefault('paths', set())
+    if lock_path in held:
+        yield
+        return
+    with _thread_locks_guard:
+        entry = _thread_locks.setdefault(lock_path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        with entry[0], open(lock_path, 'a') as fh:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            held.add(lock_path)
+            try:
+                yield
+            finally:
+                held.discard(lock_path)
+                if fcntl:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+    finally:
+        with _thread_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _thread_locks[lock_path]  # only locks in use are kept
+
+def remove_lock_file(file_path):
+    """Delete the lock sidecar of a data file that is gone for good"""
+    try:
+        os.remove(_lock_path(file_path))
+    except FileNotFoundError:
+        pass
+
+@contextmanager
+def atomic_file(file_path):
+    """Yield a temp path next to file_path; if the block succeeds it is fsync'd and os.replace'd over it"""
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(file_path) + '.',
+                               suffix='.tmp', dir=os.path.dirname(file_path) or '.')
+    os.close(fd)
+    try:
+        yield tmp
+        with open(tmp, 'rb') as f:
+            os.fsync(f.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp)
+        else:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, file_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def save_workbook(wb, file_path):
+    """Save through a temp file and os.replace, so a crash never leaves a half-written workbook"""
+    with atomic_file(file_path) as tmp:
+        wb.save(tmp)
+        record_io('save', file_path, os.path.getsize(tmp))
+
+def write_json(file_path, data):
+    """Atomically replace a JSON document"""
+    with atomic_file(file_path) as tmp:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+def _load_json(file_path):
+    with open(file_path, encoding='utf-8') as f:
+        return json.load(f)
+
+@contextmanager
+def locked_workbook(file_path):
+    """Load a workbook under its file lock and save it back atomically when the block succeeds"""
+    with file_lock(file_path):
+        wb = load_workbook(file_path)
+        yield wb
+        save_workbook(wb, file_path)
+
+def write_sheet(file_path, headers, rows=()):
+    """(Over)write a single-sheet workbook"""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(headers)
+    for row in rows:
+        ws.append(list(row))
+    with file_lock(file_path):
+        save_workbook(wb, file_path)
+
+def create_sheet(file_path, headers, rows=()):
+    """Create a workbook unless it exists (checked under the lock, so workers don't race)"""
+    if os.path.exists(file_path):
+        return
+    with file_lock(file_path):
+        if not os.path.exists(file_path):
+            write_sheet(file_path, headers, rows)
+
 def ensure_files():
     # Create directories if they don't exist
     os.makedirs(REPORTS_DIR, exist_ok=True)
     os.makedirs(ARCHIVE_DIR, exist_ok=True)
-    
+
     # User file setup
-    if not os.path.exists(USER_FILE):
-        wb = Workbook()
-        ws = wb.active
-        ws.append(['Username', 'Password', 'Role'])
-        ws.append(['admin', 'admin123', 'admin'])
-        ws.append(['cashier', '1234', 'cashier'])
-        wb.save(USER_FILE)
+    create_sheet(USER_FILE, USER_HEADERS, DEFAULT_USERS)
 
     # Product files with buying price (only visible to admin)
-    for file, headers in [
-        (PRODUCT_FILE, ['Product', 'Buy Price', 'Sell Price', 'Stock']),
-        (OIL_FILE, ['Oil', 'Buy Price', 'Sell Price', 'Stock']), 
-        (WHEEL_FILE, ['Wheel', 'Buy Price', 'Sell Price', 'Stock'])
-    ]:
-        if not os.path.exists(file):
-            wb = Workbook()
-            ws = wb.active
-            ws.append(headers)
-            wb.save(file)
-
-    # Monthly transaction files
-    current_month = datetime.now().strftime("%Y-%m")
-    for prefix in [CREDIT_FILE_PREFIX, MEDGULF_FILE_PREFIX]:
-        filename = f"{prefix}{current_month}.xlsx"
-        if not os.path.exists(filename):
-            wb = Workbook()
-            ws = wb.active
-            ws.append(['Customer Name', 'Product', 'Price', 'Quantity', 'Total', 'DateTime', 'ReceiptID'])
-            wb.save(filename)
-
-    # Daily sales file
-    if not os.path.exists(SALES_FILE):
-        wb = Workbook()
-        ws = wb.active
-        ws.append(['Product', 'Price', 'Quantity', 'Total', 'DateTime', 'ReceiptID'])
-        wb.save(SALES_FILE)
+    for file, headers in CATALOG_HEADERS.items():
+        create_sheet(file, headers)
+
+    # Current sales/debts/MedGulf partitions
+    for ledger, headers in LEDGER_HEADERS.items():
+        create_sheet(ledger_file(ledger), headers)
+
+    split_legacy_sales_log()
+
+def ledger_file(ledger, period=None):
+    """Live partition file of a ledger holding the given date (today by default)"""
+    period = period or datetime.now().strftime('%Y-%m-%d')
+    return f"{LEDGER_PREFIXES[ledger]}{period[:PARTITION_KEY_LEN[ledger]]}.xlsx"
 
-def get_monthly_file(prefix):
-    """Get current month's transaction file"""
-    return f"{prefix}{datetime.now().strftime('%Y-%m')}.xlsx"
+def partition_key(ledger, filename):
+    """Date key ('YYYY-MM-DD' or 'YYYY-MM') of a ledger partition file name, or None"""
+    prefix = LEDGER_PREFIXES[ledger]
+    if not (filename.startswith(prefix) and filename.endswith('.xlsx')):
+        return None
+    key = filename[len(prefix):-len('.xlsx')]
+    pattern = r'\d{4}-\d{2}-\d{2}' if PARTITION_KEY_LEN[ledger] == 10 else r'\d{4}-\d{2}'
+    return key if re.fullmatch(pattern, key) else None
+
+def partition_files(ledger, period=''):
+    """Live and archived partition files of a ledger overlapping a date prefix, oldest first.
+
+    `period` is '', 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD'. Asking for a single partition
+    (or a day of a monthly ledger) is a direct path check, no directory listing.
+    """
+    if len(period) >= PARTITION_KEY_LEN[ledger]:
+        name = ledger_file(ledger, period)
+        return [p for p in (name, os.path.join(ARCHIVE_DIR, name)) if os.path.exists(p)][:1]
+    found = {}
+    for folder in (ARCHIVE_DIR, '.'):
+        if not os.path.isdir(folder):
+            continue
+        for filename in os.listdir(folder):
+            key = partition_key(ledger, filename)
+            if key and key.startswith(period):
+                found[key] = filename if folder == '.' else os.path.join(folder, filename)
+    return [found[k] for k in sorted(found)]
 
 def archive_old_files():
-    """Move old monthly files to archive"""
+    """Move partitions of past months (daily sales and monthly debts/MedGulf files) to archive"""
     current_month = datetime.now().strftime("%Y-%m")
     for filename in os.listdir('.'):
-        if filename.startswith((CREDIT_FILE_PREFIX, MEDGULF_FILE_PREFIX)):
-            try:
-                file_month = filename.split('_')[-1].split('.')[0]
-            except Exception:
+        for ledger in LEDGER_PREFIXES:
+            key = partition_key(ledger, filename)
+            if key is None or key[:7] == current_month:
                 continue
-            if file_month != current_month:
-                try:
+            try:
+                with file_lock(filename):
+                    compact_journal(filename)
                     shutil.move(filename, os.path.join(ARCHIVE_DIR, filename))
-                except Exception as e:
-                    app.logger.error(f"Error archiving {filename}: {str(e)}")
+            except Exception as e:
+                app.logger.error(f"Error archiving {filename}: {str(e)}")
+
+def split_legacy_sales_log():
+    """One-time split of the old single sales_log.xlsx into daily partitions.
+
+    Rows already present in a partition are not copied twice, so an interrupted
+    split can simply run again. The old file is kept in ARCHIVE_DIR afterwards.
+    """
+    if not os.path.exists(SALES_FILE):
+        return
+    current_month = datetime.now().strftime("%Y-%m")
+    with file_lock(SALES_FILE):
+        if not os.path.exists(SALES_FILE):
+            return
+        by_day = {}
+        for row in read_ledger_file(SALES_FILE):
+            day = str(row[4])[:10]
+            if partition_key('sales', ledger_file('sales', day)) is None:
+                app.logger.warning(f"Legacy sales row without a usable date left in archive: {row}")
+                continue
+            by_day.setdefault(day, []).append(row)
+        for day, rows in sorted(by_day.items()):
+            path = ledger_file('sales', day)
+            if day[:7] != current_month:
+                path = os.path.join(ARCHIVE_DIR, path)
+            with file_lock(path):
+                existing = read_ledger_file(path)
+                write_sheet(path, SALES_HEADERS, existing + [r for r in rows if r not in existing])
+                if os.path.exists(journal_path(path)):
+                    os.remove(journal_path(path))
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        compact_journal(SALES_FILE)
+        shutil.move(SALES_FILE, os.path.join(ARCHIVE_DIR, SALES_FILE))
+
+# --------------------------
+# Read cache
+# --------------------------
+# Parsed files are memoized per (path, kind) and reused until the file's
+# (mtime, size) signature changes, so steady-state page renders skip openpyxl.
+_file_cache = {}
+
+def file_signature(file_path):
+    """Return (mtime_ns, size) of a file, or None if it doesn't exist"""
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def cached_parse(file_path, kind, build):
+    """Return build(file_path), memoized until the file changes on disk"""
+    sig = file_signature(file_path)
+    if sig is None:
+        _file_cache.pop((file_path, kind), None)
+        return None
+    cached = _file_cache.get((file_path, kind))
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    value = build(file_path)
+    _file_cache[(file_path, kind)] = (sig, value)
+    return value
+
+def _read_rows(file_path):
+    return tuple(iter_table(file_path))
+
+def iter_table(file_path):
+    """Stream the data rows of an Excel file as tuples, in read-only mode"""
+    if not os.path.exists(file_path):
+        return
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        for row in wb.active.iter_rows(min_row=2, values_only=True):
+            if not row or row[0] is None:
+                continue
+            yield row
+    finally:
+        wb.close()
 
 def read_table(file_path):
     """Read data from Excel file"""
-    if not os.path.exists(file_path):
+    rows = cached_parse(file_path, 'rows', _read_rows)
+    if rows is None:
         return []
-    wb = load_workbook(file_path)
-    ws = wb.active
-    return [list(row) for row in ws.iter_rows(min_row=2, values_only=True) if row and row[0] is not None]
+    return [list(row) for row in rows]
+
+def prefix_range(prefix):
+    """[since, until) bounds matching every date text that starts with prefix"""
+    # '~' sorts after every character used in the datetime text
+    return prefix, prefix + '~'
+
+# --------------------------
+# Change notifications
+# --------------------------
+# In-process caches (the stock engine, the catalog index) must not go stale
+# when another worker or app instance changes the data. Writers publish a
+# topic on the change bus after committing; readers compare the topic's
+# version with the one they last validated, which is a memory read, and only
+# then go back to the files or the database. Edits made outside the app (an
+# xlsx opened in Excel) are still caught by revalidating every
+# CHANGE_RECHECK_SECONDS.
+CHANGE_TOPICS = ('stock', 'catalog')  # stock levels; catalog names and prices
+
+class LocalChangeBus:
+    """Topic versions in a memory-mapped file shared by every process on the host"""
+    SLOT = struct.Struct('<Q')
+
+    def __init__(self, path, topics):
+        self.path = path
+        self.offsets = {topic: i * self.SLOT.size for i, topic in enumerate(topics)}
+        self._map = None
+
+    def _mapped(self):
+        if self._map is None:
+            size = len(self.offsets) * self.SLOT.size
+            with file_lock(self.path):
+                with open(self.path, 'a+b') as f:
+                    if os.path.getsize(self.path) < size:
+                        f.truncate(size)
+                    self._map = mmap.mmap(f.fileno(), size)
+        return self._map
+
+    def version(self, topic):
+        return self.SLOT.unpack_from(self._mapped(), self.offsets[topic])[0]
+
+    def publish(self, *topics):
+        with file_lock(self.path):
+            buf = self._mapped()
+            for topic in topics:
+                offset = self.offsets[topic]
+                self.SLOT.pack_into(buf, offset, self.SLOT.unpack_from(buf, offset)[0] + 1)
+
+CHANGE_BUSES = {'local': LocalChangeBus}  # POS_CHANGE_BUS picks one; all share version()/publish()
+
+change_bus = CHANGE_BUSES[CHANGE_BUS](CHANGE_FILE, CHANGE_TOPICS)
+
+class ChangeWatch:
+    """Tells a cache when to revalidate: after a publish on its topics, or every CHANGE_RECHECK_SECONDS"""
+
+    def __init__(self, *topics):
+        self.topics = topics
+        self._seen = None
+        self._checked = 0.0
+
+    def changed(self):
+        """Current versions of the topics if the cache must revalidate, else None"""
+        versions = tuple(change_bus.version(topic) for topic in self.topics)
+        if versions == self._seen and time.monotonic() - self._checked < CHANGE_RECHECK_SECONDS:
+            return None
+        return versions
+
+    def validated(self, versions):
+        """Record that the cache is current as of `versions` (read before revalidating)"""
+        self._seen = versions
+        self._checked = time.monotonic()
+
+# --------------------------
+# Ledger journals
+# --------------------------
+# A journaled ledger is its xlsx file plus a JSONL journal of rows appended
+# since the last compaction. Appends only touch the journal; compaction folds
+# it into the workbook (atomically) and then removes it. A journal equal to the
+# workbook's last rows was left by a compaction that crashed before removing
+# it: receipt ids are unique (CartStore.new_receipt_id), so two receipts never
+# write identical rows.
+def journal_path(ledger_file):
+    return os.path.splitext(ledger_file)[0] + '.journal.jsonl'
+
+def _parse_journal(file_path):
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    rows = []
+    for line in data[:data.rfind(b'\n') + 1].splitlines():
+        try:
+            rows.append(tuple(json.loads(line)))
+        except ValueError:
+            continue  # fenced-off torn line from a crashed writer
+    return rows
+
+def journal_rows(ledger_file):
+    """Rows waiting in a ledger's journal.
+
+    If the journal is exactly the tail of the workbook, a compaction crashed
+    before it could remove the journal; callers check for that and ignore it.
+    """
+    return [list(r) for r in cached_parse(journal_path(ledger_file), 'journal', _parse_journal) or ()]
+
+def iter_ledger_file(ledger_file, date_col=None, since='', until=None):
+    """Stream the compacted rows of a ledger workbook followed by its pending journal rows.
+
+    Ledgers are appended in time order, so a date range stops the scan early.
+    """
+    # Journal before workbook: a compaction landing in between then shows up as
+    # an already-folded journal instead of rows silently going missing.
+    pending = journal_rows(ledger_file)
+    # The last len(pending) workbook rows are held back until the end of the
+    # scan to tell whether the journal was already folded into them.
+    held = deque()
+    for row in iter_table(ledger_file):
+        held.append(list(row))
+        if len(held) > len(pending):
+            row = held.popleft()
+            if not _in_range(row, date_col, since, until):
+                if until is not None and str(row[date_col]) >= until:
+                    return
+                continue
+            yield row
+    tail = list(held)
+    for row in tail + ([] if tail == pending else pending):
+        if _in_range(row, date_col, since, until):
+            yield row
+
+def _in_range(row, date_col, since, until):
+    if date_col is None:
+        return True
+    when = str(row[date_col])
+    return when >= since and (until is None or when < until)
+
+def read_ledger_file(ledger_file):
+    """Compacted rows of a ledger workbook followed by its pending journal rows"""
+    return list(iter_ledger_file(ledger_file))
+
+def append_journal(ledger_file, rows):
+    """Durably append rows to a ledger's journal; compacts it once it grows past JOURNAL_COMPACT_BYTES"""
+    path = journal_path(ledger_file)
+    payload = ''.join(json.dumps(list(r), ensure_ascii=False, default=str) + '\n' for r in rows).encode('utf-8')
+    with file_lock(ledger_file):
+        with open(path, 'ab+') as f:
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    payload = b'\n' + payload  # fence off a torn line left by a crashed writer
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        record_io('append', path, len(payload))
+        if size >= JOURNAL_COMPACT_BYTES:
+            compact_journal(ledger_file)
+
+def compact_live_journals():
+    """Fold the journals of this month's sales partitions; returns the number of rows moved"""
+    return sum(compact_journal(path) for path in partition_files('sales', datetime.now().strftime("%Y-%m")))
+
+def compact_journal(ledger_file):
+    """Fold a ledger's journal into its workbook; returns the number of rows moved"""
+    path = journal_path(ledger_file)
+    with file_lock(ledger_file):
+        if not os.path.exists(path):
+            return 0
+        pending = journal_rows(ledger_file)
+        # Only the workbook's last len(pending) rows can hold an already-folded
+        # journal; stream them rather than caching the whole partition.
+        tail = deque((list(row) for row in iter_table(ledger_file)), maxlen=len(pending))
+        if pending and list(tail) == pending:
+            pending = []
+        if pending:
+            with locked_workbook(ledger_file) as wb:
+                ws = wb.active
+                for row in pending:
+                    ws.append(row)
+        os.remove(path)
+        return len(pending)
+
+# --------------------------
+# Archive sidecars
+# --------------------------
+# Archived partitions never change, so each one is parsed once into a columnar
+# JSON sidecar in HISTORY_CACHE_DIR and history queries read that instead of
+# the xlsx. Missing sidecars are built in parallel on a process pool. The
+# sidecar's name carries the partition's (mtime, size) signature, so its
+# freshness is a stat; sidecars are read uncached, keeping history out of memory.
+def sidecar_path(archive_file):
+    """Sidecar of the partition as it is now on disk (None if it doesn't exist)"""
+    sig = file_signature(archive_file)
+    if sig is None:
+        return None
+    return os.path.join(HISTORY_CACHE_DIR, f"{os.path.basename(archive_file)}.{sig[0]}-{sig[1]}.json")
+
+def _json_cell(value):
+    return value if value is None or isinstance(value, (str, int, float)) else str(value)
+
+def build_sidecar(archive_file):
+    """Parse an archived partition into its sidecar; returns the row count"""
+    rows = read_ledger_file(archive_file)
+    width = max((len(r) for r in rows), default=0)
+    columns = [[_json_cell(r[i]) if i < len(r) else None for r in rows] for i in range(width)]
+    os.makedirs(HISTORY_CACHE_DIR, exist_ok=True)
+    path = sidecar_path(archive_file)
+    write_json(path, {'columns': columns})
+    stale_prefix = os.path.basename(archive_file) + '.'
+    for name in os.listdir(HISTORY_CACHE_DIR):
+        if name.startswith(stale_prefix) and name.endswith('.json') and name != os.path.basename(path):
+            os.remove(os.path.join(HISTORY_CACHE_DIR, name))  # built from an older version of the partition
+    return len(rows)
+
+def load_sidecar(archive_file):
+    """Columns of an archived partition, or None if its sidecar is missing or stale"""
+    path = sidecar_path(archive_file)
+    if path is None:
+        return None
+    try:
+        return _load_json(path)['columns']
+    except FileNotFoundError:
+        return None
+
+def prepare_sidecars(archive_files):
+    """Build the missing sidecars of archived partitions, several at a time"""
+    missing = [p for p in archive_files if os.path.exists(p) and not os.path.exists(sidecar_path(p) or '')]
+    if len(missing) > 1 and HISTORY_WORKERS > 1:
+        # spawn, not fork: the gunicorn worker forking this may be running other threads
+        with ProcessPoolExecutor(max_workers=min(HISTORY_WORKERS, len(missing)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            list(pool.map(build_sidecar, missing))
+    else:
+        for path in missing:
+            build_sidecar(path)
 
 # --------------------------
 # Authentication
 # --------------------------
 def validate_login(username, password):
-    if not os.path.exists(USER_FILE):
-        return None
-    wb = load_workbook(USER_FILE)
-    ws = wb.active
-    for row in ws.iter_rows(min_row=2, values_only=True):
-        if row and str(row[0]).lower() == username.lower() and str(row[1]) == password:
-            return row[2] if len(row) > 2 and row[2] else 'cashier'
-    return None
+    return storage.validate_login(username, password)
 
 # --------------------------
 # Inventory Management
 # --------------------------
-def get_products():
-    """Get products with buying price (admin only)"""
-    out = []
-    for r in read_table(PRODUCT_FILE):
+class CatalogItem:
+    """One parsed catalog row (products, oils and wheels share the layout)"""
+    __slots__ = ('name', 'buy_price', 'price', 'stock')
+
+    def __init__(self, name, buy_price, price, stock):
+        self.name = name
+        self.buy_price = buy_price
+        self.price = price
+        self.stock = stock
+
+    @classmethod
+    def from_row(cls, row):
+        """Build from [Name, Buy Price, Sell Price, Stock]; None if the row is unusable"""
         try:
-            item = {
-                'name': str(r[0]),
-                'price': float(r[2]),  # Selling price
-                'stock': int(r[3])
-            }
-            if session.get('role') == 'admin':
-                item['buy_price'] = float(r[1])  # Buying price
-            out.append(item)
+            name, price, stock = str(row[0]), float(row[2]), int(row[3])
         except Exception:
-            continue
-    return out
+            return None
+        try:
+            buy_price = float(row[1])
+        except Exception:
+            buy_price = None
+        return cls(name, buy_price, price, stock)
+
+    def to_dict(self, with_buy_price=False):
+        item = {'name': self.name, 'price': self.price, 'stock': self.stock}
+        if with_buy_price:
+            item['buy_price'] = self.buy_price
+        return item
+
+def _parse_catalog(file_path):
+    items = (CatalogItem.from_row(r) for r in _read_rows(file_path))
+    return tuple(it for it in items if it is not None)
+
+def load_catalog(file_path):
+    """Cached catalog items of a products/oils/wheels file"""
+    return cached_parse(file_path, 'catalog', _parse_catalog) or ()
+
+def catalog_view(file_path):
+    """Catalog as template dicts; buying price is projected in for admins only"""
+    if session.get('role') == 'admin':
+        return [it.to_dict(True) for it in storage.catalog_items(file_path) if it.buy_price is not None]
+    return [it.to_dict() for it in storage.catalog_items(file_path)]
+
+def get_products():
+    """Get products with buying price (admin only)"""
+    return catalog_view(PRODUCT_FILE)
 
 def get_oils():
     """Get oils with buying price (admin only)"""
-    out = []
-    for r in read_table(OIL_FILE):
-        try:
-            item = {
-                'name': str(r[0]),
-                'price': float(r[2]),
-                'stock': int(r[3])
-            }
-            if session.get('role') == 'admin':
-                item['buy_price'] = float(r[1])
-            out.append(item)
-        except Exception:
-            continue
-    return out
+    return catalog_view(OIL_FILE)
 
 def get_wheels():
     """Get wheels with buying price (admin only)"""
-    out = []
-    for r in read_table(WHEEL_FILE):
+    return catalog_view(WHEEL_FILE)
+
+class InventoryEngine:
+    """In-memory stock for all catalogs, backed by an append-only write-ahead log.
+
+    The xlsx files are the base snapshot. Every stock change is appended to the
+    WAL (and fsync'd) first, then applied to the in-memory dicts by replaying the
+    new WAL bytes, so workers sharing the WAL converge on the same numbers.
+    Once the WAL holds WAL_SNAPSHOT_EVERY changes, the 'compact' maintenance
+    task writes the stock back to the xlsx files and the WAL starts over, so
+    checkouts never wait on workbook I/O. On startup the base is loaded and
+    the WAL replayed.
+    """
+
+    def __init__(self, catalog_files, wal_file):
+        self.catalog_files = tuple(catalog_files)
+        self.wal_file = wal_file
+        self._lock = threading.RLock()
+        self._items = {}        # file_path -> {name: CatalogItem}
+        self._base = None       # signatures of the catalog files the state was built from
+        self._wal_ino = None
+        self._wal_pos = 0
+        self._wal_entries = 0
+        self._watch = ChangeWatch('stock', 'catalog')
+
+    def _wal_stat(self):
         try:
-            item = {
-                'name': str(r[0]),
-                'price': float(r[2]),
-                'stock': int(r[3])
-            }
-            if session.get('role') == 'admin':
-                item['buy_price'] = float(r[1])
-            out.append(item)
-        except Exception:
-            continue
-    return out
+            st = os.stat(self.wal_file)
+        except OSError:
+            return None, 0
+        return st.st_ino, st.st_size
 
-def get_stock_from_file(file_path, item_name):
-    """Check current stock level"""
-    if not os.path.exists(file_path): 
-        return 0
-    wb = load_workbook(file_path)
-    ws = wb.active
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == item_name:
+    def _refresh(self):
+        """Bring the in-memory state up to date with the files on disk (if anything was published)"""
+        versions = self._watch.changed()
+        if versions is None:
+            return
+        base = tuple(file_signature(f) for f in self.catalog_files)
+        wal_ino, wal_size = self._wal_stat()
+        if base != self._base or wal_ino != self._wal_ino or wal_size < self._wal_pos:
+            self._reload(base)
+        elif wal_size > self._wal_pos:
+            self._replay()
+        self._watch.validated(versions)
+
+    def _reload(self, base):
+        self._items = {}
+        for file_path in self.catalog_files:
+            items = {}
+            for it in load_catalog(file_path):
+                items.setdefault(it.name, CatalogItem(it.name, it.buy_price, it.price, it.stock))
+            self._items[file_path] = items
+        self._base = base
+        self._wal_ino, _ = self._wal_stat()
+        self._wal_pos = 0
+        self._wal_entries = 0
+        self._replay()
+
+    def _replay(self):
+        """Apply WAL entries written since the last replay"""
+        if self._wal_ino is None:
+            return
+        with open(self.wal_file, 'rb') as f:
+            f.seek(self._wal_pos)
+            data = f.read()
+        end = data.rfind(b'\n') + 1  # a torn trailing line is left for the next replay
+        for line in data[:end].splitlines():
             try:
-                return int(row[3].value or 0)
+                entry = json.loads(line)
+                item = self._items.get(entry['f'], {}).get(entry['n'])
+                delta = int(entry['d'])
             except Exception:
-                return 0
-    return 0
-
-def pending_in_session(item_name, item_type='product'):
-    """Check for pending items in current session (to avoid overselling in UI)"""
-    pending = 0
-    items = session.get('receipt_items', [])
-    for it in items:
-        name = it.get('name', '')
-        qty = int(it.get('quantity', 0))
-        if item_type == 'oil' and name.startswith('Oil Change (') and name.endswith(')'):
-            inner = name.replace('Oil Change (', '').replace(')', '')
-            if inner == item_name:
-                pending += qty
-        elif item_type == 'wheel' and name.startswith('Wheel Change (') and name.endswith(')'):
-            inner = name.replace('Wheel Change (', '').replace(')', '')
-            if inner == item_name:
-                pending += qty
-        elif item_type == 'product' and not ('Oil Change (' in name or 'Wheel Change (' in name):
-            if name == item_name:
-                pending += qty
-    return pending
-
-def get_available_stock(file_path, item_name, item_type='product'):
-    """Calculate available stock considering pending items"""
-    base = get_stock_from_file(file_path, item_name)
-    pending = pending_in_session(item_name, item_type)
-    return base - pending
-
-def update_stock(file_path, product_name, quantity):
-    """Update stock after sale (subtract quantity). quantity should be positive integer (we subtract inside)"""
-    if not os.path.exists(file_path): 
-        return
-    wb = load_workbook(file_path)
-    ws = wb.active
-    changed = False
-    for row in ws.iter_rows(min_row=2):
-        if row[0].value == product_name:
-            try:
-                curr = int(row[3].value or 0)
-                row[3].value = max(0, curr - quantity)
-                changed = True
+                app.logger.error(f"Skipping bad stock WAL entry: {line[:200]!r}")
+                continue
+            self._wal_entries += 1
+            if item is not None:
+                item.stock = max(0, item.stock + delta)
+        self._wal_pos += end
+
+    def items(self, file_path):
+        """Current catalog items of a file, in file order"""
+        with self._lock:
+            self._refresh()
+            return list(self._items.get(file_path, {}).values())
+
+    def get(self, file_path, name):
+        with self._lock:
+            self._refresh()
+            return self._items.get(file_path, {}).get(name)
+
+    def stock(self, file_path, name):
+        item = self.get(file_path, name)
+        return item.stock if item is not None else 0
+
+    def apply(self, changes):
+        """Log and apply stock changes given as (file_path, name, delta) tuples"""
+        if not changes:
+            return
+        payload = ''.join(
+            json.dumps({'f': f, 'n': n, 'd': int(d)}, ensure_ascii=False) + '\n' for f, n, d in changes
+        ).encode('utf-8')
+        with self._lock, file_lock(self.wal_file):
+            self._refresh()
+            if self._wal_stat()[1] > self._wal_pos:
+                payload = b'\n' + payload  # fence off a torn line left by a crashed writer
+            with open(self.wal_file, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            if self._wal_ino is None:
+                self._wal_ino, _ = self._wal_stat()
+            self._replay()
+            change_bus.publish('stock')
+
+    def snapshot_due(self):
+        """Whether the WAL has grown enough to be folded into the xlsx files"""
+        with self._lock:
+            self._refresh()
+            return self._wal_entries >= WAL_SNAPSHOT_EVERY
+
+    def snapshot(self):
+        """Write current stock back to the xlsx files and start a fresh WAL"""
+        with self._lock, file_lock(self.wal_file):
+            self._refresh()
+            for file_path, items in self._items.items():
+                if not items or not os.path.exists(file_path):
+                    continue
+                with file_lock(file_path):
+                    wb = load_workbook(file_path)
+                    ws = wb.active
+                    changed = False
+                    seen = set()
+                    for row in ws.iter_rows(min_row=2):
+                        name = str(row[0].value) if row[0].value is not None else None
+                        item = items.get(name)
+                        if item is None or name in seen:
+                            continue
+                        seen.add(name)
+                        if row[3].value != item.stock:
+                            row[3].value = item.stock
+                            changed = True
+                    if changed:
+                        save_workbook(wb, file_path)
+            tmp = self.wal_file + '.tmp'
+            open(tmp, 'wb').close()
+            os.replace(tmp, self.wal_file)
+            self._reload(tuple(file_signature(f) for f in self.catalog_files))
+            change_bus.publish('stock')
+
+    def upsert(self, file_path, items):
+        """Add or update catalog items, given as {name: (buy_price, sell_price, stock)}, in one write of the file"""
+        with self._lock, file_lock(self.wal_file):
+            self.snapshot()  # fold the WAL first so the new stock isn't adjusted by old changes
+            with locked_workbook(file_path) as wb:
+                ws = wb.active
+                seen = set()
+                for row in ws.iter_rows(min_row=2):
+                    name = str(row[0].value) if row[0].value is not None else None
+                    if name in items:
+                        row[1].value, row[2].value, row[3].value = items[name]
+                        seen.add(name)
+                for name, values in items.items():
+                    if name not in seen:
+                        ws.append([name, *values])
+            self._reload(tuple(file_signature(f) for f in self.catalog_files))
+            change_bus.publish('stock', 'catalog')
+
+stock_engine = InventoryEngine([PRODUCT_FILE, OIL_FILE, WHEEL_FILE], STOCK_WAL_FILE)
+
+def get_stock_from_file(file_path, item_name):
+    """Check current stock level"""
+    return storage.stock(file_path, item_name)
+
+def get_available_stock(file_path, item_name):
+    """Stock minus the units held by every open cart"""
+    return get_stock_from_file(file_path, item_name) - carts.held(file_path, item_name)
+
+# --------------------------
+# Catalog search
+# --------------------------
+# Names are matched on normalized word prefixes: "mot 10w" finds "Motul 10W40".
+# Arabic is folded too (diacritics and tatweel dropped, alef/yeh/teh marbuta
+# variants unified) so spelling variants of a part name still match.
+ARABIC_FOLD = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه', 'ـ': None})
+ARABIC_MARKS = re.compile('[\u064b-\u0652\u0670]')
+
+def normalize_text(text):
+    return ARABIC_MARKS.sub('', str(text).casefold()).translate(ARABIC_FOLD)
+
+def search_tokens(text):
+    return re.findall(r'\w+', normalize_text(text))
+
+class CatalogIndex:
+    """Sorted (token, item number) pairs over the names of all catalogs.
+
+    The items having a token that starts with a prefix are one bisect away;
+    a query matches items that have such a token for every query word.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries  # [(file_path, name)] in catalog order
+        pairs = sorted((tok, n) for n, (_, name) in enumerate(entries) for tok in set(search_tokens(name)))
+        self.keys = [tok for tok, _ in pairs]
+        self.ids = [n for _, n in pairs]
+
+    def prefix(self, token):
+        lo = bisect_left(self.keys, token)
+        hi = bisect_left(self.keys, token + '\uffff', lo)
+        return set(self.ids[lo:hi])
+
+    def search(self, query):
+        """Item numbers matching every word of the query, in catalog order"""
+        matches = None
+        for token in search_tokens(query):
+            found = self.prefix(token)
+            matches = found if matches is None else matches & found
+            if not matches:
                 break
-            except Exception:
+        return range(len(self.entries)) if matches is None else sorted(matches)
+
+_catalog_index = None
+_catalog_watch = ChangeWatch('catalog')
+
+def catalog_index():
+    """Index over the current catalog names, rebuilt only when names are added or renamed"""
+    global _catalog_index
+    versions = _catalog_watch.changed()
+    if versions is None:
+        return _catalog_index  # nothing published since the names were last listed
+    entries = [(file_path, it.name) for file_path in CATALOG_KINDS for it in storage.catalog_items(file_path)]
+    index = _catalog_index
+    if index is None or index.entries != entries:
+        index = _catalog_index = CatalogIndex(entries)
+    _catalog_watch.validated(versions)
+    return index
+
+def search_catalog(query, file_paths=None, offset=0, limit=None):
+    """(total matches, [(file_path, CatalogItem)] for the requested page)"""
+    index = catalog_index()
+    hits = [n for n in index.search(query) if file_paths is None or index.entries[n][0] in file_paths]
+    page = hits[offset:None if limit is None else offset + limit]
+    items = ((index.entries[n][0], storage.catalog_item(*index.entries[n])) for n in page)
+    return len(hits), [(file_path, it) for file_path, it in items if it is not None]
+
+# --------------------------
+# Inventory import / export
+# --------------------------
+IMPORT_MAX_ERRORS = 10  # row problems listed back to the user per upload
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def _upload_rows(upload):
+    """Rows of an uploaded .csv or .xlsx file, header included"""
+    filename = (upload.filename or '').lower()
+    if filename.endswith('.xlsx'):
+        wb = load_workbook(upload.stream, read_only=True)
+        try:
+            yield from wb.active.iter_rows(values_only=True)
+        finally:
+            wb.close()
+    elif filename.endswith('.csv'):
+        yield from csv.reader(io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline=''))
+    else:
+        raise ValueError('upload a .csv or .xlsx file')
+
+def _blank(value):
+    return value is None or str(value).strip() == ''
+
+def parse_catalog_upload(upload):
+    """Validate an uploaded price list of (name, buy price, sell price, stock) rows.
+
+    Returns ({name: (buy_price, sell_price, stock)}, [row problems]). A first row
+    without numeric prices is taken as the header; a name listed twice keeps its last row.
+    """
+    items, errors = {}, []
+    for n, row in enumerate(_upload_rows(upload), start=1):
+        name, buy, sell, stock = (list(row or ()) + [None] * 4)[:4]
+        if all(_blank(v) for v in (name, buy, sell, stock)):
+            continue
+        try:
+            buy_price = 0.0 if _blank(buy) else float(buy)
+            sell_price = float(sell)
+            stock = 0.0 if _blank(stock) else float(stock)
+        except (TypeError, ValueError):
+            if n > 1:
+                errors.append(f"Row {n}: prices and stock must be numbers")
+            continue
+        name = '' if _blank(name) else str(name).strip()
+        if not name:
+            errors.append(f"Row {n}: missing name")
+        elif min(buy_price, sell_price, stock) < 0 or not stock.is_integer():
+            errors.append(f"Row {n}: prices and stock must be positive, stock a whole number")
+        else:
+            items[name] = (buy_price, sell_price, int(stock))
+    return items, errors
+
+def csv_response(filename, headers, rows):
+    """Stream rows as a CSV download, one line at a time"""
+    def generate():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        yield '\ufeff'  # lets Excel open the UTF-8 (Arabic) text correctly
+        for row in itertools.chain([headers], rows):
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def xlsx_response(filename, headers, rows):
+    """Send rows as an xlsx download built in openpyxl write-only mode"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(headers)
+    for row in rows:
+        ws.append(list(row))
+    out = tempfile.TemporaryFile()
+    wb.save(out)
+    out.seek(0)
+    return send_file(out, as_attachment=True, download_name=filename, mimetype=XLSX_MIMETYPE)
+
+DATE_PREFIX = re.compile(r'\d{4}(-\d{2}(-\d{2})?)?')
+
+def export_range(since, until):
+    """[since, until) DateTime bounds for inclusive YYYY[-MM[-DD]] dates (either may be empty)"""
+    for value in (since, until):
+        if value and not DATE_PREFIX.fullmatch(value):
+            raise ValueError(f"'{value}' is not a YYYY-MM-DD date")
+    return since, (prefix_range(until)[1] if until else None)
+
+# --------------------------
+# Transaction Processing
+# --------------------------
+def is_service_or_used(item_name):
+    """Return True if item is service or used part (Arabic variant included)"""
+    if item_name is None:
+        return False
+    name = str(item_name)
+    return (name.startswith('Service') or name.startswith('Used Part') or name.startswith('قطعة مستعملة') or name.startswith('Used Part:'))
+
+def stock_target(item_name):
+    """Map a receipt line to (inventory file, catalog name); None for services and used parts"""
+    if is_service_or_used(item_name):
+        return None
+    if item_name.startswith('Oil Change (') and item_name.endswith(')'):
+        return OIL_FILE, item_name[len('Oil Change ('):-1]
+    if item_name.startswith('Wheel Change (') and item_name.endswith(')'):
+        return WHEEL_FILE, item_name[len('Wheel Change ('):-1]
+    return PRODUCT_FILE, item_name
+
+def receipt_stock_changes(receipt_items):
+    """Group a receipt's stock decrements by inventory file: {file_path: {name: qty}}"""
+    grouped = {}
+    for item in receipt_items:
+        target = stock_target(item['name'])
+        if target is None:
+            continue
+        file_path, name = target
+        per_file = grouped.setdefault(file_path, {})
+        per_file[name] = per_file.get(name, 0) + int(item['quantity'])
+    return grouped
+
+def receipt_stock_deltas(receipt_items):
+    """A receipt's decrements as (file_path, name, -qty) tuples, one per catalog item"""
+    grouped = receipt_stock_changes(receipt_items)
+    return [(f, name, -qty) for f, per_file in grouped.items() for name, qty in per_file.items()]
+
+def receipt_rows(receipt_items, receipt_id, customer_name=None, now=None):
+    """Ledger rows for a receipt, in the sales (or customer ledger) column layout"""
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    for item in receipt_items:
+        product, price, qty = item['name'], float(item['price']), int(item['quantity'])
+        row = [product, price, qty, price * qty, now, receipt_id]
+        rows.append(row if customer_name is None else [customer_name] + row)
+    return rows
+
+def log_receipt(ledger, receipt_items, receipt_id, customer_name=None):
+    """Append a receipt to a ledger and apply all its stock decrements as one batch"""
+    rows = receipt_rows(receipt_items, receipt_id, customer_name)
+    storage.record_receipt(ledger, rows, receipt_stock_deltas(receipt_items))
+    update_aggregates(ledger, rows)
+
+# --------------------------
+# Storage backends
+# --------------------------
+# Both backends expose the same methods; the app only talks to `storage`.
+# Catalogs are identified by their xlsx file path, ledgers by name
+# ('sales', 'debts', 'medgulf'). Ledger rows keep the xlsx column layout.
+class XlsxStorage:
+    """Default backend: users, catalogs and ledgers live in xlsx files next to the app"""
+    name = 'xlsx'
+
+    def ensure(self):
+        ensure_files()
+
+    def rollover(self, day):
+        """Create the ledger partitions receipts of `day` (YYYY-MM-DD) will go to"""
+        for ledger, headers in LEDGER_HEADERS.items():
+            create_sheet(ledger_file(ledger, day), headers)
+
+    def archive(self):
+        archive_old_files()
+
+    def compact(self):
+        compact_live_journals()
+        if stock_engine.snapshot_due():
+            stock_engine.snapshot()
+
+    def validate_login(self, username, password):
+        for row in read_table(USER_FILE):
+            if str(row[0]).lower() == username.lower() and str(row[1]) == password:
+                return row[2] if len(row) > 2 and row[2] else 'cashier'
+        return None
+
+    def catalog_items(self, file_path):
+        return stock_engine.items(file_path)
+
+    def catalog_item(self, file_path, name):
+        return stock_engine.get(file_path, name)
+
+    def stock(self, file_path, name):
+        return stock_engine.stock(file_path, name)
+
+    def apply_stock(self, changes):
+        stock_engine.apply(changes)
+
+    def add_catalog_item(self, file_path, name, buy_price, sell_price, stock):
+        with locked_workbook(file_path) as wb:
+            wb.active.append([name, buy_price, sell_price, stock])
+        change_bus.publish('stock', 'catalog')
+
+    def upsert_catalog_items(self, file_path, items):
+        stock_engine.upsert(file_path, items)
+
+    def record_receipt(self, ledger, rows, stock_deltas):
+        """Append a receipt's ledger rows and apply its (file_path, name, delta) stock changes"""
+        file_path = ledger_file(ledger)
+        if not os.path.exists(file_path):  # only if the maintenance rollover didn't run
+            create_sheet(file_path, LEDGER_HEADERS[ledger])
+        if ledger == 'sales' and SALES_JOURNAL:
+            append_journal(file_path, rows)
+        else:
+            with locked_workbook(file_path) as wb:
+                ws = wb.active
+                for row in rows:
+                    ws.append(row)
+        self.apply_stock(stock_deltas)
+
+    def ledger_version(self, ledger, prefix):
+        """Changes whenever rows are added to the ledger partitions covering prefix"""
+        return [(p, file_signature(p), file_signature(journal_path(p))) for p in partition_files(ledger, prefix)]
+
+    def iter_ledger(self, ledger, since='', until=None):
+        """Stream the rows of a ledger whose DateTime text falls in [since, until), oldest first"""
+        key_len = PARTITION_KEY_LEN[ledger]
+        col = LEDGER_HEADERS[ledger].index('DateTime')
+        common = os.path.commonprefix([since, until]) if until is not None else ''
+        paths = []
+        for path in partition_files(ledger, common[:key_len]):
+            key = partition_key(ledger, os.path.basename(path))
+            if key and ((until is not None and key >= until) or key + '~' <= since):
+                continue  # partition entirely outside the range: never opened
+            paths.append(path)
+        archived = [p for p in paths if os.path.dirname(p) == ARCHIVE_DIR]
+        prepare_sidecars(archived)
+        for path in paths:
+            columns = load_sidecar(path) if path in archived else None
+            if columns is None:
+                yield from iter_ledger_file(path, col, since, until)
                 continue
-    if changed:
-        wb.save(file_path)
+            for row in zip(*columns):
+                if _in_range(row, col, since, until):
+                    yield list(row)
+
+    def ledger_rows(self, ledger, prefix):
+        """Rows of a ledger whose DateTime starts with prefix ('YYYY-MM' or 'YYYY-MM-DD')"""
+        return list(self.iter_ledger(ledger, *prefix_range(prefix)))
+
+class SqliteStorage:
+    """SQLite backend: users, catalogs and all ledgers in one indexed database file"""
+    name = 'sqlite'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY COLLATE NOCASE,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'cashier'
+        );
+        CREATE TABLE IF NOT EXISTS catalog (
+            id INTEGER PRIMARY KEY,
+            catalog TEXT NOT NULL,
+            name TEXT NOT NULL,
+            buy_price REAL,
+            sell_price REAL NOT NULL,
+            stock INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_catalog_name ON catalog (catalog, name);
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            ledger TEXT NOT NULL,
+            customer TEXT,
+            product TEXT NOT NULL,
+            price REAL,
+            quantity INTEGER,
+            total REAL,
+            datetime TEXT NOT NULL,
+            receipt_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_tx_datetime ON transactions (ledger, datetime);
+        CREATE INDEX IF NOT EXISTS idx_tx_customer ON transactions (ledger, customer);
+        CREATE INDEX IF NOT EXISTS idx_tx_receipt ON transactions (receipt_id);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def connection(self):
+        """Per-thread connection in autocommit mode; writes go through transaction()"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def ensure(self):
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        with self.transaction() as conn:
+            if conn.execute('SELECT 1 FROM users LIMIT 1').fetchone() is None:
+                conn.executemany('INSERT INTO users (username, password, role) VALUES (?, ?, ?)', DEFAULT_USERS)
+
+    def rollover(self, day):
+        pass  # no partitions
+
+    def archive(self):
+        pass  # rows stay in place; every query is bounded by datetime
+
+    def compact(self):
+        conn = self.connection()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('PRAGMA optimize')
+
+    def validate_login(self, username, password):
+        row = self.connection().execute(
+            'SELECT password, role FROM users WHERE username = ?', (username,)).fetchone()
+        if row and str(row[0]) == password:
+            return row[1] or 'cashier'
+        return None
+
+    def catalog_items(self, file_path):
+        rows = self.connection().execute(
+            'SELECT name, buy_price, sell_price, stock FROM catalog WHERE catalog = ? ORDER BY id',
+            (CATALOG_KINDS[file_path],))
+        return [CatalogItem(*r) for r in rows]
+
+    def catalog_item(self, file_path, name):
+        row = self.connection().execute(
+            'SELECT name, buy_price, sell_price, stock FROM catalog WHERE catalog = ? AND name = ?',
+            (CATALOG_KINDS[file_path], name)).fetchone()
+        return CatalogItem(*row) if row else None
+
+    def stock(self, file_path, name):
+        row = self.connection().execute(
+            'SELECT stock FROM catalog WHERE catalog = ? AND name = ?', (CATALOG_KINDS[file_path], name)).fetchone()
+        return int(row[0]) if row else 0
+
+    def _apply_stock(self, conn, changes):
+        conn.executemany(
+            'UPDATE catalog SET stock = MAX(0, stock + ?) WHERE catalog = ? AND name = ?',
+            [(int(d), CATALOG_KINDS[f], n) for f, n, d in changes])
+
+    def apply_stock(self, changes):
+        with self.transaction() as conn:
+            self._apply_stock(conn, changes)
+        change_bus.publish('stock')
+
+    def add_catalog_item(self, file_path, name, buy_price, sell_price, stock):
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO catalog (catalog, name, buy_price, sell_price, stock) VALUES (?, ?, ?, ?, ?)',
+                (CATALOG_KINDS[file_path], name, buy_price, sell_price, stock))
+        change_bus.publish('stock', 'catalog')
+
+    def upsert_catalog_items(self, file_path, items):
+        """Add or update catalog items, given as {name: (buy_price, sell_price, stock)}"""
+        with self.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO catalog (catalog, name, buy_price, sell_price, stock) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (catalog, name) DO UPDATE SET buy_price = excluded.buy_price, '
+                'sell_price = excluded.sell_price, stock = excluded.stock',
+                [(CATALOG_KINDS[file_path], name, *values) for name, values in items.items()])
+        change_bus.publish('stock', 'catalog')
+
+    @staticmethod
+    def _tx_params(ledger, row):
+        if ledger != 'sales':
+            return (ledger,) + tuple(row)
+        return (ledger, None) + tuple(row)
+
+    def _insert_rows(self, conn, ledger, rows):
+        conn.executemany(
+            'INSERT INTO transactions (ledger, customer, product, price, quantity, total, datetime, receipt_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [self._tx_params(ledger, r) for r in rows])
+
+    def record_receipt(self, ledger, rows, stock_deltas):
+        with self.transaction() as conn:
+            self._insert_rows(conn, ledger, rows)
+            self._apply_stock(conn, stock_deltas)
+        change_bus.publish('stock')
+
+    def ledger_version(self, ledger, prefix):
+        """Changes whenever rows are added to (or removed from) the ledger within prefix"""
+        return list(self.connection().execute(
+            'SELECT COUNT(*), MAX(id) FROM transactions WHERE ledger = ? AND datetime >= ? AND datetime < ?',
+            (ledger, prefix, prefix + '~')).fetchone())
+
+    def iter_ledger(self, ledger, since='', until=None):
+        """Stream the rows of a ledger whose DateTime text falls in [since, until), oldest first"""
+        cols = 'product, price, quantity, total, datetime, receipt_id'
+        if ledger != 'sales':
+            cols = 'customer, ' + cols
+        query = f'SELECT {cols} FROM transactions WHERE ledger = ? AND datetime >= ?'
+        params = [ledger, since]
+        if until is not None:
+            query += ' AND datetime < ?'
+            params.append(until)
+        for row in self.connection().execute(query + ' ORDER BY id', params):
+            yield list(row)
+
+    def ledger_rows(self, ledger, prefix):
+        """Rows of a ledger whose DateTime starts with prefix ('YYYY-MM' or 'YYYY-MM-DD')"""
+        return list(self.iter_ledger(ledger, *prefix_range(prefix)))
+
+def migrate_xlsx_to_sqlite(db_path):
+    """Copy users, catalogs and every ledger (live and archived) from the xlsx files into SQLite.
+
+    Replaces whatever the database held before. Returns {table: rows copied}.
+    """
+    xlsx = XlsxStorage()
+    db = SqliteStorage(db_path)
+    counts = {}
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM users')
+        conn.execute('DELETE FROM catalog')
+        conn.execute('DELETE FROM transactions')
+        users = [(str(r[0]), str(r[1]), r[2] if len(r) > 2 and r[2] else 'cashier') for r in read_table(USER_FILE)]
+        conn.executemany('INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)', users)
+        counts['users'] = len(users)
+        counts['catalog'] = 0
+        for file_path, kind in CATALOG_KINDS.items():
+            items = [(kind, it.name, it.buy_price, it.price, it.stock) for it in xlsx.catalog_items(file_path)]
+            conn.executemany(
+                'INSERT OR IGNORE INTO catalog (catalog, name, buy_price, sell_price, stock) VALUES (?, ?, ?, ?, ?)',
+                items)
+            counts['catalog'] += len(items)
+        split_legacy_sales_log()
+        counts['transactions'] = 0
+        for ledger, path in [(ledger, path) for ledger in LEDGER_PREFIXES for path in partition_files(ledger)]:
+            width = len(LEDGER_HEADERS[ledger])
+            rows = [(r + [None] * width)[:width] for r in read_ledger_file(path)]
+            for row in rows:
+                row[-2] = str(row[-2])  # DateTime comes back as a datetime if the sheet was edited in Excel
+            db._insert_rows(conn, ledger, rows)
+            counts['transactions'] += len(rows)
+    return counts
+
+def export_sqlite_to_xlsx(db_path):
+    """Write the SQLite contents back out as the xlsx files the xlsx backend reads.
+
+    Partitions present in the database are overwritten; those of past months go to ARCHIVE_DIR.
+    """
+    db = SqliteStorage(db_path)
+    conn = db.connection()
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    write_sheet(USER_FILE, USER_HEADERS, conn.execute('SELECT username, password, role FROM users ORDER BY rowid'))
+    with file_lock(STOCK_WAL_FILE):
+        for file_path, kind in CATALOG_KINDS.items():
+            rows = conn.execute(
+                'SELECT name, buy_price, sell_price, stock FROM catalog WHERE catalog = ? ORDER BY id', (kind,))
+            write_sheet(file_path, CATALOG_HEADERS[file_path], rows)
+        if os.path.exists(STOCK_WAL_FILE):
+            os.remove(STOCK_WAL_FILE)  # the exported catalogs already carry the current stock
+    current_month = datetime.now().strftime("%Y-%m")
+    for ledger, headers in LEDGER_HEADERS.items():
+        keys = [k for (k,) in conn.execute(
+            'SELECT DISTINCT substr(datetime, 1, ?) FROM transactions WHERE ledger = ?',
+            (PARTITION_KEY_LEN[ledger], ledger))]
+        for key in keys:
+            path = ledger_file(ledger, key)
+            if key[:7] != current_month:
+                path = os.path.join(ARCHIVE_DIR, path)
+            with file_lock(path):
+                write_sheet(path, headers, db.ledger_rows(ledger, key))
+                if os.path.exists(journal_path(path)):
+                    os.remove(journal_path(path))
+        create_sheet(ledger_file(ledger), headers)
+
+@app.cli.command('migrate-sqlite')
+def migrate_sqlite_command():
+    """Import the xlsx files into the SQLite database (replaces its contents)"""
+    counts = migrate_xlsx_to_sqlite(SQLITE_FILE)
+    print(', '.join(f"{n} {table}" for table, n in counts.items()) + f" copied into {SQLITE_FILE}")
+
+@app.cli.command('compact-journal')
+def compact_journal_command():
+    """Fold the sales journals of live partitions into their workbooks"""
+    print(f"Compacted {compact_live_journals()} journal rows")
+
+@app.cli.command('export-xlsx')
+def export_xlsx_command():
+    """Write the SQLite database back out as xlsx files"""
+    export_sqlite_to_xlsx(SQLITE_FILE)
+    print(f"Exported {SQLITE_FILE} to xlsx files")
+
+storage = SqliteStorage(SQLITE_FILE) if STORAGE_BACKEND == 'sqlite' else XlsxStorage()
+
+# --------------------------
+# Dashboard aggregates
+# --------------------------
+# Running totals kept in DASHBOARD_FILE and updated at finalize time, so the
+# dashboard never rescans the ledgers. rebuild_aggregates() recomputes them and
+# records each ledger's high-water mark: the latest DateTime it folded and the
+# receipts logged at that time. Receipts written while a rebuild scans the
+# ledgers are then not folded a second time by their own finalize.
+#
+# Per-item units by day (for sales velocity) are kept apart, one small file per
+# day in DAILY_UNITS_DIR, so a finalize only rewrites today's bucket.
+def _empty_aggregates():
+    return {'revenue': {}, 'units': {}, 'balances': {'debts': {}, 'medgulf': {}},
+            'marks': {ledger: ['', []] for ledger in LEDGER_PREFIXES}}
+
+def _aggregates_current(agg):
+    """False for a missing aggregates file or one written by an older version"""
+    return agg is not None and 'marks' in agg and 'daily_units' not in agg
+
+def daily_units_file(day):
+    return os.path.join(DAILY_UNITS_DIR, f"{day}.json")
+
+def load_daily_units(day):
+    """{product: units sold} on a day (YYYY-MM-DD)"""
+    return cached_parse(daily_units_file(day), 'json', _load_json) or {}
+
+def _row_stamp(ledger, row):
+    """(DateTime, ReceiptID) text of a ledger row"""
+    offset = 0 if ledger == 'sales' else 1
+    return str(row[4 + offset]), str(row[5 + offset])
+
+def _track_mark(mark, ledger, rows):
+    """Pass rows through, advancing the [DateTime, [ReceiptID...]] high-water mark"""
+    for row in rows:
+        at, receipt = _row_stamp(ledger, row)
+        if at > mark[0]:
+            mark[0], mark[1] = at, [receipt]
+        elif at == mark[0] and receipt not in mark[1]:
+            mark[1].append(receipt)
+        yield row
+
+def _past_mark(mark, ledger, rows):
+    """Rows not already counted by the rebuild that set the mark"""
+    fresh = []
+    for row in rows:
+        at, receipt = _row_stamp(ledger, row)
+        if at > mark[0] or (at == mark[0] and receipt not in mark[1]):
+            fresh.append(row)
+    return fresh
+
+def _fold_rows(agg, daily_units, ledger, rows):
+    """Add ledger rows (in the xlsx column layout) into the aggregates and {day: {product: units}}"""
+    payment = PAYMENT_TYPES[ledger]
+    for r in rows:
+        if ledger == 'sales':
+            customer, product, qty, total, dt = None, r[0], r[2], r[3], r[4]
+        else:
+            customer, product, qty, total, dt = r[0], r[1], r[3], r[4], r[5]
+        try:
+            qty, total = int(qty), float(total)
+        except Exception:
+            continue
+        per_day = agg['revenue'].setdefault(str(dt)[:10], {})
+        per_day[payment] = round(per_day.get(payment, 0.0) + total, 2)
+        agg['units'][str(product)] = agg['units'].get(str(product), 0) + qty
+        units = daily_units.setdefault(str(dt)[:10], {})
+        units[str(product)] = units.get(str(product), 0) + qty
+        if customer is not None:
+            balances = agg['balances'][ledger]
+            balances[str(customer)] = round(balances.get(str(customer), 0.0) + total, 2)
+
+def prune_daily_units():
+    """Remove per-day units files older than VELOCITY_DAYS"""
+    if not os.path.isdir(DAILY_UNITS_DIR):
+        return
+    cutoff = (datetime.now() - timedelta(days=VELOCITY_DAYS)).strftime('%Y-%m-%d')
+    for name in os.listdir(DAILY_UNITS_DIR):
+        if name.endswith('.json') and name[:-len('.json')] < cutoff:
+            os.remove(os.path.join(DAILY_UNITS_DIR, name))
+
+def load_aggregates():
+    """Current aggregates; empty until maintenance (or `flask rebuild-dashboard`) has built them"""
+    agg = cached_parse(DASHBOARD_FILE, 'json', _load_json)
+    return agg if _aggregates_current(agg) else _empty_aggregates()
+
+def update_aggregates(ledger, rows):
+    with file_lock(DASHBOARD_FILE):
+        agg = _load_json(DASHBOARD_FILE) if os.path.exists(DASHBOARD_FILE) else None
+        if not _aggregates_current(agg):
+            return  # not built yet: the rebuild will read these rows from the ledger
+        daily_units = {}
+        _fold_rows(agg, daily_units, ledger, _past_mark(agg['marks'][ledger], ledger, rows))
+        write_json(DASHBOARD_FILE, agg)
+        os.makedirs(DAILY_UNITS_DIR, exist_ok=True)
+        for day, sold in daily_units.items():
+            units = dict(load_daily_units(day))
+            for product, qty in sold.items():
+                units[product] = units.get(product, 0) + qty
+            write_json(daily_units_file(day), units)
+
+def ensure_aggregates():
+    """Build the aggregates if they are missing or in an older format"""
+    with file_lock(DASHBOARD_FILE):
+        if not _aggregates_current(_load_json(DASHBOARD_FILE) if os.path.exists(DASHBOARD_FILE) else None):
+            rebuild_aggregates()
+
+def rebuild_aggregates():
+    """Recompute the aggregates and per-day units from every ledger (live and archived)"""
+    with file_lock(DASHBOARD_FILE):
+        agg, daily_units = _empty_aggregates(), {}
+        for ledger in LEDGER_PREFIXES:
+            rows = _track_mark(agg['marks'][ledger], ledger, storage.iter_ledger(ledger))
+            _fold_rows(agg, daily_units, ledger, rows)
+        cutoff = (datetime.now() - timedelta(days=VELOCITY_DAYS)).strftime('%Y-%m-%d')
+        os.makedirs(DAILY_UNITS_DIR, exist_ok=True)
+        for name in os.listdir(DAILY_UNITS_DIR):
+            if name.endswith('.json') and name[:-len('.json')] not in daily_units:
+                os.remove(os.path.join(DAILY_UNITS_DIR, name))
+        for day, units in daily_units.items():
+            if day >= cutoff:
+                write_json(daily_units_file(day), units)
+        prune_daily_units()
+        write_json(DASHBOARD_FILE, agg)
+    return agg
+
+def dashboard_summary(days=14, top=20):
+    """Numbers shown on /dashboard, derived from the aggregates only"""
+    agg = load_aggregates()
+    now = datetime.now()
+    today, month = now.strftime('%Y-%m-%d'), now.strftime('%Y-%m')
+    month_totals = {}
+    for day, per_type in agg['revenue'].items():
+        if day.startswith(month):
+            for payment, total in per_type.items():
+                month_totals[payment] = round(month_totals.get(payment, 0.0) + total, 2)
+    recent = sorted(agg['revenue'])[-days:]
+    return {
+        'today': today,
+        'month': month,
+        'today_revenue': agg['revenue'].get(today, {}),
+        'month_revenue': month_totals,
+        'daily_revenue': [{'day': d, **agg['revenue'][d]} for d in reversed(recent)],
+        'top_items': sorted(agg['units'].items(), key=lambda kv: -kv[1])[:top],
+        'balances': {ledger: sorted(b.items(), key=lambda kv: -kv[1]) for ledger, b in agg['balances'].items()},
+    }
+
+@app.cli.command('rebuild-dashboard')
+def rebuild_dashboard_command():
+    """Recompute the dashboard aggregates from the ledgers"""
+    agg = rebuild_aggregates()
+    print(f"Rebuilt dashboard aggregates over {len(agg['revenue'])} days")
+
+# --------------------------
+# Customer balances
+# --------------------------
+# The aggregates already carry every customer's debts/MedGulf total (kept up to
+# date at finalize time, rebuilt from live and archived ledgers), so a balance
+# lookup is a dict hit. CustomerIndex adds name matching on top: spellings that
+# normalize alike ("ali", "Ali ") are one customer, and names sorted by their
+# normalized form give prefix autocomplete by bisect.
+CUSTOMER_LEDGERS = ('debts', 'medgulf')
+CUSTOMER_SUGGESTIONS = 10
+
+def customer_key(name):
+    return ' '.join(search_tokens(name))
+
+class CustomerIndex:
+    def __init__(self, balances):
+        self.balances = balances  # aggregates' {ledger: {customer: total}}
+        self.names = {}  # customer_key -> spellings as entered
+        for ledger in CUSTOMER_LEDGERS:
+            for name in balances[ledger]:
+                spellings = self.names.setdefault(customer_key(name), [])
+                if name not in spellings:
+                    spellings.append(name)
+        self.keys = sorted(self.names)
+
+    def lookup(self, name):
+        """{'customer', 'names', ledger: balance...} for a customer, or None if unknown"""
+        spellings = self.names.get(customer_key(name))
+        if not spellings:
+            return None
+        found = {'customer': spellings[0], 'names': spellings}
+        for ledger in CUSTOMER_LEDGERS:
+            found[ledger] = round(sum(self.balances[ledger].get(n, 0.0) for n in spellings), 2)
+        return found
+
+    def complete(self, prefix, limit=CUSTOMER_SUGGESTIONS):
+        """Customers whose normalized name starts with the normalized prefix"""
+        key = customer_key(prefix)
+        start = bisect_left(self.keys, key)
+        stop = bisect_left(self.keys, key + '\uffff', start)
+        return [self.lookup(k) for k in self.keys[start:min(stop, start + limit)]]
+
+_customer_index = None
+
+def customer_index():
+    """Index over the current aggregates; rebuilt only after they changed"""
+    global _customer_index
+    balances = load_aggregates()['balances']
+    index = _customer_index
+    if index is None or index.balances is not balances:
+        index = _customer_index = CustomerIndex(balances)
+    return index
 
 # --------------------------
-# Transaction Processing
+# Reorder suggestions
 # --------------------------
-def is_service_or_used(item_name):
-    """Return True if item is service or used part (Arabic variant included)"""
-    if item_name is None:
-        return False
-    name = str(item_name)
-    return (name.startswith('Service') or name.startswith('Used Part') or name.startswith('قطعة مستعملة') or name.startswith('Used Part:'))
+# Sales velocity comes from the per-day units files, which every finalize
+# updates with just its own rows, so the report never reads a ledger: it adds
+# up at most VELOCITY_DAYS small dicts and compares with the stock.
+def reorder_suggestions(window=REORDER_WINDOW_DAYS, lead_days=REORDER_LEAD_DAYS, target_days=REORDER_TARGET_DAYS):
+    """Catalog items with units/day over the last `window` days, days of cover and a reorder quantity.
 
-def log_sale(receipt_items, receipt_id):
-    """Record cash sale"""
-    wb = load_workbook(SALES_FILE)
-    ws = wb.active
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for item in receipt_items:
-        product, price, qty = item['name'], float(item['price']), int(item['quantity'])
-        total = price * qty
-        ws.append([product, price, qty, total, now, receipt_id])
-        
-        # Only update stock if it's a regular product (not service or used part)
-        if not is_service_or_used(product):
-            if product.startswith('Oil Change (') and product.endswith(')'):
-                oil = product.replace('Oil Change (', '').replace(')', '')
-                update_stock(OIL_FILE, oil, qty)
-            elif product.startswith('Wheel Change (') and product.endswith(')'):
-                wheel = product.replace('Wheel Change (', '').replace(')', '')
-                update_stock(WHEEL_FILE, wheel, qty)
-            else:
-                # normal product
-                update_stock(PRODUCT_FILE, product, qty)
-    wb.save(SALES_FILE)
+    Items covering less than `lead_days` are flagged; the suggested order tops
+    the stock up to `target_days` of sales. Least cover first.
+    """
+    now = datetime.now()
+    sold = {}
+    for offset in range(window):
+        day = (now - timedelta(days=offset)).strftime('%Y-%m-%d')
+        for product, qty in load_daily_units(day).items():
+            target = stock_target(product)
+            if target is not None:
+                sold[target] = sold.get(target, 0) + qty
+    rows = []
+    for file_path, kind in CATALOG_KINDS.items():
+        for it in storage.catalog_items(file_path):
+            per_day = sold.get((file_path, it.name), 0) / window
+            cover = it.stock / per_day if per_day else None
+            rows.append({'kind': kind, 'name': it.name, 'stock': it.stock, 'units_per_day': round(per_day, 2),
+                         'days_of_cover': None if cover is None else round(cover, 1),
+                         'reorder': cover is not None and cover < lead_days,
+                         'suggested_qty': max(0, math.ceil(per_day * target_days - it.stock))})
+    rows.sort(key=lambda r: (r['days_of_cover'] is None, r['days_of_cover'] or 0, r['name']))
+    return rows
 
-def log_credit(receipt_items, receipt_id, customer_name):
-    """Record credit sale"""
-    file_path = get_monthly_file(CREDIT_FILE_PREFIX)
-    if not os.path.exists(file_path):
-        ensure_files()
-        
-    wb = load_workbook(file_path)
-    ws = wb.active
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for item in receipt_items:
-        product, price, qty = item['name'], float(item['price']), int(item['quantity'])
-        total = price * qty
-        ws.append([customer_name, product, price, qty, total, now, receipt_id])
-        
-        # Only update stock if it's a regular product (not service or used part)
-        if not is_service_or_used(product):
-            if product.startswith('Oil Change (') and product.endswith(')'):
-                oil = product.replace('Oil Change (', '').replace(')', '')
-                update_stock(OIL_FILE, oil, qty)
-            elif product.startswith('Wheel Change (') and product.endswith(')'):
-                wheel = product.replace('Wheel Change (', '').replace(')', '')
-                update_stock(WHEEL_FILE, wheel, qty)
-            else:
-                update_stock(PRODUCT_FILE, product, qty)
-    wb.save(file_path)
+# --------------------------
+# Report cache
+# --------------------------
+# A generated report is reused until the ledgers it reads change. Its version
+# (a hash of the ledgers' versions) doubles as the HTTP ETag.
+REPORT_LEDGERS = {'daily': ('sales', 'debts', 'medgulf'), 'debts': ('debts',), 'medgulf': ('medgulf',),
+                  'debts-yearly': ('debts',), 'medgulf-yearly': ('medgulf',)}
 
-def log_medgulf(receipt_items, receipt_id, customer_name):
-    """Record MedGulf sale"""
-    file_path = get_monthly_file(MEDGULF_FILE_PREFIX)
-    if not os.path.exists(file_path):
-        ensure_files()
-        
-    wb = load_workbook(file_path)
-    ws = wb.active
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for item in receipt_items:
-        product, price, qty = item['name'], float(item['price']), int(item['quantity'])
-        total = price * qty
-        ws.append([customer_name, product, price, qty, total, now, receipt_id])
-        
-        # Only update stock if it's a regular product (not service or used part)
-        if not is_service_or_used(product):
-            if product.startswith('Oil Change (') and product.endswith(')'):
-                oil = product.replace('Oil Change (', '').replace(')', '')
-                update_stock(OIL_FILE, oil, qty)
-            elif product.startswith('Wheel Change (') and product.endswith(')'):
-                wheel = product.replace('Wheel Change (', '').replace(')', '')
-                update_stock(WHEEL_FILE, wheel, qty)
-            else:
-                update_stock(PRODUCT_FILE, product, qty)
-    wb.save(file_path)
+def report_version(kind, period):
+    parts = [kind, period] + [storage.ledger_version(ledger, period) for ledger in REPORT_LEDGERS[kind]]
+    return hashlib.sha1(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+def report_stamp_file(kind):
+    return os.path.join(REPORTS_DIR, f".{kind}.version.json")
+
+def cached_report(kind, period, generate):
+    """Return (path, version) of a report, running generate() only if its ledgers changed"""
+    stamp_file = report_stamp_file(kind)
+    with file_lock(stamp_file):  # one worker builds, the others wait and reuse it
+        version = report_version(kind, period)
+        stamp = _load_json(stamp_file) if os.path.exists(stamp_file) else {}
+        if stamp.get('version') == version and os.path.exists(stamp.get('path', '')):
+            return stamp['path'], version
+        started = time.perf_counter()
+        path = generate()
+        metrics.observe('pos_report_build_seconds', {'kind': kind}, time.perf_counter() - started)
+        write_json(stamp_file, {'version': version, 'path': path})
+        return path, version
+
+def send_report(kind, period, generate):
+    """Send a (cached) report; answers 304 when the client's copy is still current"""
+    # Report filenames aren't versioned: open the file before releasing the
+    # stamp lock, so a concurrent rebuild can't swap newer content in under this ETag.
+    with file_lock(report_stamp_file(kind)):
+        path, version = cached_report(kind, period, generate)
+        f = open(path, 'rb')
+    return send_file(f, as_attachment=True, download_name=os.path.basename(path), etag=version, conditional=True)
+
+def save_document(doc, filepath):
+    with atomic_file(filepath) as tmp:
+        doc.save(tmp)
+        record_io('save', filepath, os.path.getsize(tmp))
 
 # --------------------------
 # Report Generation
 # --------------------------
+# Tables are written as one block of WordprocessingML and parsed once, instead
+# of growing a python-docx table cell by cell (which gets slower with every row
+# and made the month-end reports crawl). The XML matches what doc.add_table()
+# produces, so the documents look the same.
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+def money(value):
+    try:
+        return f"{float(value):.2f}"
+    except Exception:
+        return str(value)
+
+def quantity(value):
+    try:
+        return str(int(value))
+    except Exception:
+        return str(value)
+
+# (header, cell formatter) per ledger column, in the xlsx column layout
+SALES_REPORT_COLUMNS = [('Product', str), ('Price', money), ('Qty', quantity), ('Total', money),
+                        ('DateTime', str), ('ReceiptID', str)]
+CUSTOMER_REPORT_COLUMNS = [('Customer', str)] + SALES_REPORT_COLUMNS
+
+def _cell_xml(text, width):
+    text = XML_INVALID_CHARS.sub('', text)
+    run = f'<w:r><w:t xml:space="preserve">{xml_escape(text)}</w:t></w:r>' if text else ''
+    return f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr><w:p>{run}</w:p></w:tc>'
+
+def add_table(doc, headers, rows):
+    """Append a table with a header row and rows of cell strings to doc in a single pass"""
+    section = doc.sections[-1]
+    width = (section.page_width - section.left_margin - section.right_margin) // len(headers) // 635  # EMU -> twips
+    parts = [f'<w:tbl xmlns:w="{W_NAMESPACE}"><w:tblPr><w:tblW w:type="auto" w:w="0"/>'
+             '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/>'
+             '</w:tblPr><w:tblGrid>', f'<w:gridCol w:w="{width}"/>' * len(headers), '</w:tblGrid>']
+    for row in itertools.chain([headers], rows):
+        parts.append('<w:tr>')
+        parts.extend(_cell_xml(text, width) for text in row)
+        parts.append('</w:tr>')
+    parts.append('</w:tbl>')
+    doc.element.body._insert_tbl(parse_xml(''.join(parts)))
+
+def add_ledger_table(doc, columns, rows, headers=None):
+    """Table of ledger rows formatted per `columns`; returns the sum of the Total column"""
+    total_col = [header for header, _ in columns].index('Total')
+    subtotal = 0.0
+    cells = []
+    for r in rows:
+        cells.append([fmt(r[i]) if i < len(r) else '' for i, (_, fmt) in enumerate(columns)])
+        try:
+            subtotal += float(r[total_col])
+        except Exception:
+            pass
+    add_table(doc, headers or [header for header, _ in columns], cells)
+    return subtotal
+
+def add_ledger_section(doc, columns, rows, label, empty_message):
+    """Ledger table followed by its subtotal, or a note when there are no rows"""
+    if rows:
+        subtotal = add_ledger_table(doc, columns, rows)
+        doc.add_paragraph(f"Subtotal ({label}): {subtotal:.2f}")
+    else:
+        doc.add_paragraph(empty_message)
+
 def generate_daily_word_report():
     """Generate daily sales report"""
     today = datetime.now().strftime("%Y-%m-%d")
@@ -318,104 +1946,25 @@ def generate_daily_word_report():
 
     # Normal sales
     doc.add_heading("=== Normal Sales ===", level=2)
-    sales = [row for row in read_table(SALES_FILE) if str(row[4]).startswith(today)]
-    if sales:
-        tbl = doc.add_table(rows=1, cols=6)
-        hdr = tbl.rows[0].cells
-        hdr[0].text='Product'; hdr[1].text='Price'; hdr[2].text='Qty'; hdr[3].text='Total'; hdr[4].text='DateTime'; hdr[5].text='ReceiptID'
-        subtotal = 0.0
-        for r in sales:
-            row = tbl.add_row().cells
-            row[0].text = str(r[0])
-            try:
-                row[1].text = f"{float(r[1]):.2f}"
-            except Exception:
-                row[1].text = str(r[1])
-            row[2].text = str(int(r[2]))
-            try:
-                row[3].text = f"{float(r[3]):.2f}"
-            except Exception:
-                row[3].text = str(r[3])
-            row[4].text = str(r[4])
-            row[5].text = str(r[5])
-            try:
-                subtotal += float(r[3])
-            except Exception:
-                pass
-        doc.add_paragraph(f"Subtotal (Normal): {subtotal:.2f}")
-    else:
-        doc.add_paragraph("No normal sales for today.")
+    sales = storage.ledger_rows('sales', today)
+    add_ledger_section(doc, SALES_REPORT_COLUMNS, sales, 'Normal', "No normal sales for today.")
 
     # Debts
     doc.add_heading("=== Debt Transactions ===", level=2)
-    debts = [row for row in read_table(get_monthly_file(CREDIT_FILE_PREFIX)) if str(row[5]).startswith(today)]
-    if debts:
-        tbl = doc.add_table(rows=1, cols=7)
-        hdr = tbl.rows[0].cells
-        hdr[0].text='Customer'; hdr[1].text='Product'; hdr[2].text='Price'; hdr[3].text='Qty'; hdr[4].text='Total'; hdr[5].text='DateTime'; hdr[6].text='ReceiptID'
-        subtotal = 0.0
-        for r in debts:
-            row = tbl.add_row().cells
-            row[0].text = str(r[0]); row[1].text = str(r[1])
-            try:
-                row[2].text = f"{float(r[2]):.2f}"
-            except Exception:
-                row[2].text = str(r[2])
-            row[3].text = str(int(r[3])); 
-            try:
-                row[4].text = f"{float(r[4]):.2f}"
-            except Exception:
-                row[4].text = str(r[4])
-            row[5].text = str(r[5]); row[6].text = str(r[6])
-            try:
-                subtotal += float(r[4])
-            except Exception:
-                pass
-        doc.add_paragraph(f"Subtotal (Debts): {subtotal:.2f}")
-    else:
-        doc.add_paragraph("No debt transactions for today.")
+    add_ledger_section(doc, CUSTOMER_REPORT_COLUMNS, storage.ledger_rows('debts', today), 'Debts',
+                       "No debt transactions for today.")
 
     # MedGulf
     doc.add_heading("=== MedGulf Transactions ===", level=2)
-    med = [row for row in read_table(get_monthly_file(MEDGULF_FILE_PREFIX)) if str(row[5]).startswith(today)]
-    if med:
-        tbl = doc.add_table(rows=1, cols=7)
-        hdr = tbl.rows[0].cells
-        hdr[0].text='Customer'; hdr[1].text='Product'; hdr[2].text='Price'; hdr[3].text='Qty'; hdr[4].text='Total'; hdr[5].text='DateTime'; hdr[6].text='ReceiptID'
-        subtotal = 0.0
-        for r in med:
-            row = tbl.add_row().cells
-            row[0].text = str(r[0]); row[1].text = str(r[1])
-            try:
-                row[2].text = f"{float(r[2]):.2f}"
-            except Exception:
-                row[2].text = str(r[2])
-            row[3].text = str(int(r[3])); 
-            try:
-                row[4].text = f"{float(r[4]):.2f}"
-            except Exception:
-                row[4].text = str(r[4])
-            row[5].text = str(r[5]); row[6].text = str(r[6])
-            try:
-                subtotal += float(r[4])
-            except Exception:
-                pass
-        doc.add_paragraph(f"Subtotal (MedGulf): {subtotal:.2f}")
-    else:
-        doc.add_paragraph("No MedGulf transactions for today.")
+    add_ledger_section(doc, CUSTOMER_REPORT_COLUMNS, storage.ledger_rows('medgulf', today), 'MedGulf',
+                       "No MedGulf transactions for today.")
 
     # Services & Used Parts - appear in the Normal Sales already, but add a categorized summary section for clarity
     doc.add_heading("=== Services and Used Parts Summary ===", level=2)
     services = []
     used_parts = []
-    for r in read_table(SALES_FILE):
+    for r in sales:
         # row structure: [Product, Price, Quantity, Total, DateTime, ReceiptID]
-        try:
-            dt = str(r[4])
-        except Exception:
-            dt = ''
-        if not dt.startswith(today):
-            continue
         pname = str(r[0])
         if is_service_or_used(pname):
             # service names start with 'Service' prefix; used parts start with 'Used Part'
@@ -424,40 +1973,18 @@ def generate_daily_word_report():
             else:
                 used_parts.append(r)
     if services:
-        tbl = doc.add_table(rows=1, cols=6)
-        hdr = tbl.rows[0].cells
-        hdr[0].text='Product'; hdr[1].text='Price'; hdr[2].text='Qty'; hdr[3].text='Total'; hdr[4].text='DateTime'; hdr[5].text='ReceiptID'
-        for r in services:
-            row = tbl.add_row().cells
-            row[0].text = str(r[0])
-            try: row[1].text = f"{float(r[1]):.2f}"
-            except: row[1].text = str(r[1])
-            row[2].text = str(int(r[2]))
-            try: row[3].text = f"{float(r[3]):.2f}"
-            except: row[3].text = str(r[3])
-            row[4].text = str(r[4]); row[5].text = str(r[5])
+        add_ledger_table(doc, SALES_REPORT_COLUMNS, services)
     else:
         doc.add_paragraph("No services for today.")
 
     if used_parts:
-        tbl = doc.add_table(rows=1, cols=6)
-        hdr = tbl.rows[0].cells
-        hdr[0].text='Product'; hdr[1].text='Price'; hdr[2].text='Qty'; hdr[3].text='Total'; hdr[4].text='DateTime'; hdr[5].text='ReceiptID'
-        for r in used_parts:
-            row = tbl.add_row().cells
-            row[0].text = str(r[0])
-            try: row[1].text = f"{float(r[1]):.2f}"
-            except: row[1].text = str(r[1])
-            row[2].text = str(int(r[2]))
-            try: row[3].text = f"{float(r[3]):.2f}"
-            except: row[3].text = str(r[3])
-            row[4].text = str(r[4]); row[5].text = str(r[5])
+        add_ledger_table(doc, SALES_REPORT_COLUMNS, used_parts)
     else:
         doc.add_paragraph("No used parts for today.")
 
     filename = f"Daily_Report_{today}.docx"
     filepath = os.path.join(REPORTS_DIR, filename)
-    doc.save(filepath)
+    save_document(doc, filepath)
     return filepath
 
 def generate_debts_word_report():
@@ -467,12 +1994,12 @@ def generate_debts_word_report():
     doc.add_heading(f"Salimco - Monthly Debts Report - {month}", level=1)
     
     # Get all transactions for the month
-    transactions = read_table(get_monthly_file(CREDIT_FILE_PREFIX))
+    transactions = storage.ledger_rows('debts', month)
     
     if not transactions:
         doc.add_paragraph("No debt transactions for this month.")
         filepath = os.path.join(REPORTS_DIR, f"Debts_Report_{month}.docx")
-        doc.save(filepath)
+        save_document(doc, filepath)
         return filepath
     
     # Calculate customer totals
@@ -487,49 +2014,19 @@ def generate_debts_word_report():
     
     # Add customer summary
     doc.add_heading("Customer Debt Summary", level=2)
-    summary_table = doc.add_table(rows=1, cols=2)
-    hdr = summary_table.rows[0].cells
-    hdr[0].text = 'Customer'
-    hdr[1].text = 'Total Owed'
-    
-    for customer, total in sorted(customer_totals.items()):
-        row = summary_table.add_row().cells
-        row[0].text = customer
-        row[1].text = f"{total:.2f}"
+    add_table(doc, ['Customer', 'Total Owed'],
+              ([str(customer), f"{total:.2f}"] for customer, total in sorted(customer_totals.items())))
     
     doc.add_paragraph(f"\nGrand Total: {sum(customer_totals.values()):.2f}")
     
     # Add transaction details
     doc.add_heading("Transaction Details", level=2)
-    details_table = doc.add_table(rows=1, cols=7)
-    hdr = details_table.rows[0].cells
-    hdr[0].text = 'Customer'
-    hdr[1].text = 'Product'
-    hdr[2].text = 'Price'
-    hdr[3].text = 'Qty'
-    hdr[4].text = 'Total'
-    hdr[5].text = 'Date'
-    hdr[6].text = 'Receipt'
-    
-    for t in transactions:
-        row = details_table.add_row().cells
-        row[0].text = str(t[0])
-        row[1].text = str(t[1])
-        try:
-            row[2].text = f"{float(t[2]):.2f}"
-        except Exception:
-            row[2].text = str(t[2])
-        row[3].text = str(int(t[3]))
-        try:
-            row[4].text = f"{float(t[4]):.2f}"
-        except Exception:
-            row[4].text = str(t[4])
-        row[5].text = str(t[5])
-        row[6].text = str(t[6])
+    add_ledger_table(doc, CUSTOMER_REPORT_COLUMNS, transactions,
+                     headers=['Customer', 'Product', 'Price', 'Qty', 'Total', 'Date', 'Receipt'])
     
     filename = f"Debts_Report_{month}.docx"
     filepath = os.path.join(REPORTS_DIR, filename)
-    doc.save(filepath)
+    save_document(doc, filepath)
     return filepath
 
 def generate_medgulf_word_report():
@@ -538,40 +2035,500 @@ def generate_medgulf_word_report():
     doc = Document()
     doc.add_heading(f"Salimco - MedGulf Report - {month}", level=1)
     
-    med = read_table(get_monthly_file(MEDGULF_FILE_PREFIX))
-    if med:
-        tbl = doc.add_table(rows=1, cols=7)
-        hdr = tbl.rows[0].cells
-        hdr[0].text='Customer'; hdr[1].text='Product'; hdr[2].text='Price'; hdr[3].text='Qty'; hdr[4].text='Total'; hdr[5].text='DateTime'; hdr[6].text='ReceiptID'
-        subtotal = 0.0
-        for r in med:
-            row = tbl.add_row().cells
-            row[0].text = str(r[0]); row[1].text = str(r[1])
-            try: row[2].text = f"{float(r[2]):.2f}"
-            except: row[2].text = str(r[2])
-            row[3].text = str(int(r[3])); 
-            try: row[4].text = f"{float(r[4]):.2f}"
-            except: row[4].text = str(r[4])
-            row[5].text = str(r[5]); row[6].text = str(r[6])
-            try:
-                subtotal += float(r[4])
-            except Exception:
-                pass
-        doc.add_paragraph(f"Subtotal (MedGulf): {subtotal:.2f}")
-    else:
-        doc.add_paragraph("No MedGulf transactions for this month.")
+    add_ledger_section(doc, CUSTOMER_REPORT_COLUMNS, storage.ledger_rows('medgulf', month), 'MedGulf',
+                       "No MedGulf transactions for this month.")
     
     filename = f"MedGulf_Report_{month}.docx"
     filepath = os.path.join(REPORTS_DIR, filename)
-    doc.save(filepath)
+    save_document(doc, filepath)
+    return filepath
+
+def ledger_totals(ledger, since='', until=None):
+    """Totals of a customer ledger per customer and month over [since, until)"""
+    totals = {}
+    for r in storage.iter_ledger(ledger, since, until):
+        month = str(r[5])[:7]
+        try:
+            amount = float(r[4])
+        except Exception:
+            continue
+        if not re.fullmatch(r'\d{4}-\d{2}', month):
+            continue
+        per_month = totals.setdefault(str(r[0]), {})
+        per_month[month] = round(per_month.get(month, 0.0) + amount, 2)
+    return totals
+
+YEARLY_TITLES = {'debts': 'Debts', 'medgulf': 'MedGulf'}
+
+def generate_yearly_word_report(ledger, year):
+    """Generate a yearly debts/MedGulf report from live and archived months"""
+    title = YEARLY_TITLES[ledger]
+    doc = Document()
+    doc.add_heading(f"Salimco - Yearly {title} Report - {year}", level=1)
+
+    totals = ledger_totals(ledger, *prefix_range(year))
+    if totals:
+        # Per customer by quarter
+        doc.add_heading("Customer Totals by Quarter", level=2)
+        rows = []
+        quarter_totals = [0.0] * 4
+        for customer, per_month in sorted(totals.items()):
+            quarters = [0.0] * 4
+            for month, amount in per_month.items():
+                quarters[(int(month[5:7]) - 1) // 3] += amount
+            for i, amount in enumerate(quarters):
+                quarter_totals[i] += amount
+            rows.append([customer] + [f"{amount:.2f}" for amount in quarters + [sum(quarters)]])
+        rows.append(['Total'] + [f"{amount:.2f}" for amount in quarter_totals + [sum(quarter_totals)]])
+        add_table(doc, ['Customer', 'Q1', 'Q2', 'Q3', 'Q4', 'Total'], rows)
+
+        # Per month
+        doc.add_heading("Monthly Totals", level=2)
+        month_totals = {}
+        for per_month in totals.values():
+            for month, amount in per_month.items():
+                month_totals[month] = month_totals.get(month, 0.0) + amount
+        add_table(doc, ['Month', 'Total'], ([month, f"{amount:.2f}"] for month, amount in sorted(month_totals.items())))
+    else:
+        doc.add_paragraph(f"No {title} transactions for this year.")
+
+    filename = f"{title}_Report_{year}.docx"
+    filepath = os.path.join(REPORTS_DIR, filename)
+    save_document(doc, filepath)
     return filepath
 
+# --------------------------
+# Background report jobs
+# --------------------------
+# Reports can be built on a small thread pool instead of inside the request.
+# Job state lives in REPORT_JOBS_DIR so any gunicorn worker can answer a poll.
+# The job id includes the report's data version, so submitting the same report
+# again before anything changed joins the existing job. The worker owning a
+# queued or running job stamps a heartbeat into its record; a job whose
+# heartbeat went stale (its worker died) is queued again on resubmission.
+REPORT_GENERATORS = {
+    'daily': generate_daily_word_report,
+    'debts': generate_debts_word_report,
+    'medgulf': generate_medgulf_word_report,
+}
+REPORT_PERIODS = {'daily': '%Y-%m-%d', 'debts': '%Y-%m', 'medgulf': '%Y-%m'}
+
+_report_pool = ThreadPoolExecutor(max_workers=REPORT_JOB_WORKERS, thread_name_prefix='report-job')
+
+def _job_file(job_id):
+    return os.path.join(REPORT_JOBS_DIR, f"{job_id}.json")
+
+_owned_jobs = set()  # ids of the queued and running jobs of this worker
+_owned_jobs_lock = threading.Lock()
+_heartbeat_started = False
+
+def _update_job(job_id, **changes):
+    """Apply changes to a job record and refresh its heartbeat"""
+    with file_lock(_job_file(job_id)):
+        job = load_report_job(job_id)
+        job.update(changes, heartbeat=time.time())
+        write_json(_job_file(job_id), job)
+    return job
+
+def _job_alive(job):
+    return time.time() - job.get('heartbeat', 0) < REPORT_JOB_STALE
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(REPORT_JOB_HEARTBEAT)
+        with _owned_jobs_lock:
+            job_ids = list(_owned_jobs)
+        for job_id in job_ids:
+            try:
+                _update_job(job_id)
+            except Exception:
+                app.logger.exception(f"Could not stamp heartbeat of report job {job_id}")
+
+def _own_job(job_id):
+    global _heartbeat_started
+    with _owned_jobs_lock:
+        _owned_jobs.add(job_id)
+        if not _heartbeat_started:
+            threading.Thread(target=_heartbeat_loop, name='report-job-heartbeat', daemon=True).start()
+            _heartbeat_started = True
+
+def load_report_job(job_id):
+    if not re.fullmatch(r'[\w-]+', job_id or '') or not os.path.exists(_job_file(job_id)):
+        return None
+    return _load_json(_job_file(job_id))
+
+def submit_report_job(kind):
+    """Queue a report build (or join an identical one) and return its job record"""
+    period = datetime.now().strftime(REPORT_PERIODS[kind])
+    job_id = f"{kind}-{period}-{report_version(kind, period)[:12]}"
+    os.makedirs(REPORT_JOBS_DIR, exist_ok=True)
+    with file_lock(_job_file(job_id)):
+        job = load_report_job(job_id)
+        if job and job['status'] in ('queued', 'running') and _job_alive(job):
+            return job
+        if job and job['status'] == 'done' and os.path.exists(job['path']):
+            return job
+        job = {'id': job_id, 'kind': kind, 'period': period, 'status': 'queued', 'heartbeat': time.time(),
+               'submitted': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        write_json(_job_file(job_id), job)
+        _own_job(job_id)
+    _report_pool.submit(_run_report_job, job_id)
+    return job
+
+def _run_report_job(job_id):
+    job = _update_job(job_id, status='running')
+    try:
+        path, version = cached_report(job['kind'], job['period'], REPORT_GENERATORS[job['kind']])
+        result = {'status': 'done', 'path': path, 'version': version}
+    except Exception as e:
+        app.logger.exception(f"Report job {job_id} failed")
+        result = {'status': 'failed', 'error': str(e)}
+    with _owned_jobs_lock:
+        _owned_jobs.discard(job_id)
+    _update_job(job_id, finished=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **result)
+
+def prune_report_jobs():
+    """Remove finished or dead job records (and their lock files) older than REPORT_JOB_KEEP; returns how many"""
+    if not os.path.isdir(REPORT_JOBS_DIR):
+        return 0
+    removed = 0
+    cutoff = time.time() - REPORT_JOB_KEEP
+    for name in os.listdir(REPORT_JOBS_DIR):
+        if not name.endswith('.json'):
+            continue
+        job_id = name[:-len('.json')]
+        with file_lock(_job_file(job_id)):
+            job = load_report_job(job_id)
+            if job is None or job.get('heartbeat', 0) > cutoff:
+                continue
+            if job['status'] in ('queued', 'running') and _job_alive(job):
+                continue
+            os.remove(_job_file(job_id))
+            remove_lock_file(_job_file(job_id))
+        removed += 1
+    return removed
+
+def report_job_view(job):
+    """Job record as returned by the API"""
+    view = {k: job.get(k) for k in ('id', 'kind', 'period', 'status', 'submitted', 'finished', 'error')}
+    view['status_url'] = url_for('report_job_status', job_id=job['id'])
+    if job['status'] == 'done':
+        view['download_url'] = url_for('report_job_download', job_id=job['id'])
+    return view
+
+# --------------------------
+# Maintenance
+# --------------------------
+# Housekeeping runs on a background thread in every worker instead of inside
+# requests. Each task has a fixed time of day; MAINTENANCE_FILE records the
+# last slot each task ran for, under a file lock, so exactly one worker runs
+# it. A worker starting after a missed slot catches up (end-of-day reports
+# are skipped once their slot is more than MAINTENANCE_GRACE old).
+def last_slot(at, now):
+    """Most recent datetime (<= now) at which an 'HH:MM' task was due"""
+    hour, minute = map(int, at.split(':'))
+    slot = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return slot if slot <= now else slot - timedelta(days=1)
+
+def pregenerate_reports(slot):
+    """Build the day's reports ahead of the closing-time rush"""
+    for kind, generate in REPORT_GENERATORS.items():
+        cached_report(kind, slot.strftime(REPORT_PERIODS[kind]), generate)
+
+def archive_task(slot):
+    storage.archive()
+    prune_daily_units()
+
+MAINTENANCE_TASKS = {
+    # name: (time of day, task(slot), catch up after a missed slot)
+    'rollover': (MAINTENANCE_TIMES['rollover'], lambda slot: storage.rollover((slot + timedelta(days=1)).strftime('%Y-%m-%d')), True),
+    'archive': (MAINTENANCE_TIMES['archive'], archive_task, True),
+    'compact': (MAINTENANCE_TIMES['compact'], lambda slot: storage.compact(), True),
+    'jobs': (MAINTENANCE_TIMES['jobs'], lambda slot: prune_report_jobs(), True),
+    'reports': (MAINTENANCE_TIMES['reports'], pregenerate_reports, False),
+}
+
+class MaintenanceScheduler:
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self._lock = threading.Lock()
+        self._started = False
+        self._stop = threading.Event()
+
+    def prepare(self):
+        """Create missing data files and build missing aggregates.
+
+        Run once at boot (gunicorn's on_starting hook, or before app.run), so
+        no request pays for it; the maintenance thread repeats it as a no-op.
+        """
+        storage.ensure()
+        ensure_aggregates()
+
+    def start(self):
+        """Start the background thread, which prepares the data and runs due tasks; no file I/O here"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            if MAINTENANCE_ENABLED:
+                threading.Thread(target=self._loop, name='maintenance', daemon=True).start()
+            self._started = True
+
+    def _loop(self):
+        try:
+            self.prepare()
+            self.run_due()
+        except Exception:
+            app.logger.exception('Maintenance run failed')
+        while not self._stop.wait(MAINTENANCE_POLL_SECONDS):
+            try:
+                self.run_due()
+            except Exception:
+                app.logger.exception('Maintenance run failed')
+
+    def run_due(self, now=None):
+        """Run every task whose latest slot hasn't been run by any worker yet"""
+        now = now or datetime.now()
+        with file_lock(MAINTENANCE_FILE):
+            state = _load_json(MAINTENANCE_FILE) if os.path.exists(MAINTENANCE_FILE) else {}
+            for name, (at, task, catch_up) in self.tasks.items():
+                slot = last_slot(at, now)
+                stamp = slot.strftime('%Y-%m-%d %H:%M')
+                if state.get(name, '') >= stamp:
+                    continue
+                if catch_up or now - slot <= MAINTENANCE_GRACE:
+                    try:
+                        task(slot)
+                    except Exception:
+                        app.logger.exception(f"Maintenance task {name} failed")
+                        continue  # retried on the next poll
+                state[name] = stamp
+                write_json(MAINTENANCE_FILE, state)
+
+maintenance = MaintenanceScheduler(MAINTENANCE_TASKS)
+
+@app.before_request
+def _start_maintenance():
+    maintenance.start()
+
+@app.cli.command('maintenance')
+def maintenance_command():
+    """Run rollover, archiving, compaction, job pruning and report pre-generation now"""
+    maintenance.prepare()
+    now = datetime.now()
+    for name, (_, task, _) in MAINTENANCE_TASKS.items():
+        task(now)
+        print(f"Ran {name}")
+
+# --------------------------
+# Carts
+# --------------------------
+# The open receipt lives server-side, keyed by session['cart_id'], instead of in
+# the signed session cookie. Carts are written through to CART_FILE so every
+# gunicorn worker sees the same cart; each worker keeps the carts it served in
+# memory and only re-reads one when its version moved on.
+class CartStore:
+    """Open carts: {'items': [...], 'receipt_id': ...} per cart id, evicted after CART_TTL idle seconds"""
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS carts (
+            cart_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            touched REAL NOT NULL,
+            cart TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_carts_touched ON carts (touched);
+        CREATE TABLE IF NOT EXISTS holds (
+            cart_id TEXT NOT NULL,
+            catalog TEXT NOT NULL,
+            name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            PRIMARY KEY (cart_id, catalog, name)
+        );
+        CREATE INDEX IF NOT EXISTS idx_holds_item ON holds (catalog, name, expires);
+        CREATE TABLE IF NOT EXISTS receipt_ids (
+            stamp TEXT PRIMARY KEY,
+            issued INTEGER NOT NULL
+        );
+    """
+    EVICT_EVERY = 60  # seconds between sweeps for abandoned carts
+
+    def __init__(self, db_path, ttl, hold_ttl):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.hold_ttl = hold_ttl
+        self._local = threading.local()
+        self._memory = {}  # cart_id -> (version, cart)
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, cart_id):
+        """A copy of the cart, or None if it doesn't exist or has expired"""
+        row = self.connection().execute(
+            'SELECT version, touched FROM carts WHERE cart_id = ?', (cart_id,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            with self._lock:
+                self._memory.pop(cart_id, None)
+            return None
+        with self._lock:
+            cached = self._memory.get(cart_id)
+        if cached is None or cached[0] != row[0]:
+            data = self.connection().execute('SELECT cart FROM carts WHERE cart_id = ?', (cart_id,)).fetchone()
+            if data is None:
+                return None
+            cached = (row[0], json.loads(data[0]))
+            with self._lock:
+                self._memory[cart_id] = cached
+        return json.loads(json.dumps(cached[1]))
+
+    def save(self, cart_id, cart):
+        now = time.time()
+        conn = self.connection()
+        conn.execute(
+            'INSERT INTO carts (cart_id, version, touched, cart) VALUES (?, 1, ?, ?) '
+            'ON CONFLICT (cart_id) DO UPDATE SET version = version + 1, touched = excluded.touched, cart = excluded.cart',
+            (cart_id, now, json.dumps(cart, ensure_ascii=False)))
+        version = conn.execute('SELECT version FROM carts WHERE cart_id = ?', (cart_id,)).fetchone()[0]
+        conn.execute('UPDATE holds SET expires = ? WHERE cart_id = ?', (now + self.hold_ttl, cart_id))
+        with self._lock:
+            self._memory[cart_id] = (version, json.loads(json.dumps(cart)))
+        if now - self._last_evict > self.EVICT_EVERY:
+            self.evict_expired()
+
+    def delete(self, cart_id):
+        self.connection().execute('DELETE FROM carts WHERE cart_id = ?', (cart_id,))
+        self.release(cart_id)
+        with self._lock:
+            self._memory.pop(cart_id, None)
+
+    def evict_expired(self):
+        """Drop carts idle for longer than the TTL; returns how many were removed"""
+        self._last_evict = time.time()
+        cutoff = self._last_evict - self.ttl
+        removed = self.connection().execute('DELETE FROM carts WHERE touched < ?', (cutoff,)).rowcount
+        self.connection().execute('DELETE FROM holds WHERE expires < ?', (self._last_evict,))
+        self.connection().execute('DELETE FROM receipt_ids WHERE stamp < ?',
+                                  (datetime.fromtimestamp(cutoff).strftime("%Y%m%d%H%M%S"),))
+        with self._lock:
+            self._memory.clear()  # cheap to refill; avoids tracking touched times twice
+        return removed
+
+    def new_receipt_id(self):
+        """A receipt id unique across workers: the time, plus a sequence number within the second"""
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        issued = self.connection().execute(
+            'INSERT INTO receipt_ids (stamp, issued) VALUES (?, 1) '
+            'ON CONFLICT (stamp) DO UPDATE SET issued = issued + 1 RETURNING issued', (stamp,)).fetchone()[0]
+        return stamp if issued == 1 else f"{stamp}-{issued}"
+
+    # Stock holds: every cart line that takes stock reserves it here, so all
+    # cashiers (in every worker) see the same available count.
+    def held(self, file_path, name, conn=None):
+        """Units of an item reserved by live holds across all carts"""
+        conn = conn or self.connection()
+        return conn.execute(
+            'SELECT COALESCE(SUM(quantity), 0) FROM holds WHERE catalog = ? AND name = ? AND expires >= ?',
+            (file_path, name, time.time())).fetchone()[0]
+
+    def hold(self, cart_id, file_path, name, quantity):
+        """Reserve units for a cart if that many are free; returns (ok, available before the hold)"""
+        if quantity < 1:
+            raise ValueError(f"Cannot hold {quantity} units")
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')  # one reservation at a time, across workers
+        try:
+            available = storage.stock(file_path, name) - self.held(file_path, name, conn)
+            if quantity <= available:
+                now = time.time()
+                conn.execute(
+                    'INSERT INTO holds (cart_id, catalog, name, quantity, expires) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (cart_id, catalog, name) DO UPDATE SET '
+                    'quantity = CASE WHEN expires >= ? THEN quantity ELSE 0 END + excluded.quantity, '
+                    'expires = excluded.expires',
+                    (cart_id, file_path, name, quantity, now + self.hold_ttl, now))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return quantity <= available, available
+
+    def confirm(self, cart_id, needed):
+        """Make sure a cart holds {(file_path, name): units} before it is sold.
+
+        Holds that lapsed after HOLD_TTL are taken again if the stock is still
+        free, all in one transaction. Returns {(file_path, name): available} for
+        the items that are short; nothing is held then.
+        """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            short = {}
+            for (file_path, name), quantity in needed.items():
+                row = conn.execute(
+                    'SELECT quantity FROM holds WHERE cart_id = ? AND catalog = ? AND name = ? AND expires >= ?',
+                    (cart_id, file_path, name, now)).fetchone()
+                own = row[0] if row else 0
+                available = storage.stock(file_path, name) - self.held(file_path, name, conn) + own
+                if quantity > available:
+                    short[(file_path, name)] = available
+                    continue
+                conn.execute(
+                    'INSERT INTO holds (cart_id, catalog, name, quantity, expires) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (cart_id, catalog, name) DO UPDATE SET '
+                    'quantity = excluded.quantity, expires = excluded.expires',
+                    (cart_id, file_path, name, quantity, now + self.hold_ttl))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('ROLLBACK' if short else 'COMMIT')
+        return short
+
+    def release(self, cart_id, file_path=None, name=None, quantity=None):
+        """Give back held units: one line's quantity, or every hold of the cart"""
+        conn = self.connection()
+        if file_path is None:
+            conn.execute('DELETE FROM holds WHERE cart_id = ?', (cart_id,))
+            return
+        conn.execute('UPDATE holds SET quantity = quantity - ? WHERE cart_id = ? AND catalog = ? AND name = ?',
+                     (quantity, cart_id, file_path, name))
+        conn.execute('DELETE FROM holds WHERE cart_id = ? AND quantity <= 0', (cart_id,))
+
+carts = CartStore(CART_FILE, CART_TTL, HOLD_TTL)
+
+def new_receipt_id():
+    return carts.new_receipt_id()
+
+def current_cart():
+    """The signed-in user's open cart, created on first use"""
+    cart_id = session.get('cart_id')
+    cart = carts.get(cart_id) if cart_id else None
+    if cart is None:
+        cart_id = uuid.uuid4().hex
+        cart = {'items': session.pop('receipt_items', []), 'receipt_id': session.pop('receipt_id', None) or new_receipt_id()}
+        session['cart_id'] = cart_id
+        carts.save(cart_id, cart)
+    return cart
+
+def save_cart(cart):
+    carts.save(session['cart_id'], cart)
+
 # --------------------------
 # Application Routes
 # --------------------------
 @app.route('/', methods=['GET', 'POST'])
 def login():
-    ensure_files()
     if request.method == 'POST':
         username = request.form.get('username','')
         password = request.form.get('password','')
@@ -585,165 +2542,229 @@ def login():
 
 @app.route('/logout')
 def logout():
+    if session.get('cart_id'):
+        carts.delete(session['cart_id'])
     session.clear()
     return redirect(url_for('login'))
 
+FINALIZE_ACTIONS = {  # action -> (ledger, label)
+    'finalize_cash': ('sales', 'Cash'),
+    'finalize_credit': ('debts', 'Credit'),
+    'finalize_medgulf': ('medgulf', 'MedGulf'),
+}
+
+def cart_action(cart, action, form):
+    """Apply a POS action to the cart.
+
+    Returns (message, category, stock targets touched); message is None when
+    the action did nothing worth reporting (e.g. an unknown item).
+    """
+    if action == 'add_product':
+        product_name = form.get('product_name')
+        try:
+            qty = int(form.get('quantity',1))
+        except:
+            qty = 1
+        if qty < 1:
+            return 'Quantity must be at least 1', 'warning', []
+        product = storage.catalog_item(PRODUCT_FILE, product_name)
+        if product:
+            held, available = carts.hold(session['cart_id'], PRODUCT_FILE, product_name, qty)
+            if not held:
+                return f"Only {available} available in stock", 'warning', [(PRODUCT_FILE, product_name)]
+            cart['items'].append({'name': product_name, 'price': product.price, 'quantity': qty})
+            save_cart(cart)
+            return 'Added product to receipt', 'success', [(PRODUCT_FILE, product_name)]
+
+    elif action == 'add_oil':
+        oil_name = form.get('oil_name')
+        try:
+            qty = int(form.get('quantity',1))
+        except:
+            qty = 1
+        if qty < 1:
+            return 'Quantity must be at least 1', 'warning', []
+        oil = storage.catalog_item(OIL_FILE, oil_name)
+        if oil:
+            held, available = carts.hold(session['cart_id'], OIL_FILE, oil_name, qty)
+            if not held:
+                return f"Only {available} oil in stock", 'warning', [(OIL_FILE, oil_name)]
+            item_name = f"Oil Change ({oil_name})"
+            cart['items'].append({'name': item_name, 'price': oil.price, 'quantity': qty})
+            save_cart(cart)
+            return 'Added oil change to receipt', 'success', [(OIL_FILE, oil_name)]
+
+    elif action == 'add_wheel':
+        wheel_name = form.get('wheel_name')
+        try:
+            qty = int(form.get('quantity',1))
+        except:
+            qty = 1
+        if qty < 1:
+            return 'Quantity must be at least 1', 'warning', []
+        wheel = storage.catalog_item(WHEEL_FILE, wheel_name)
+        if wheel:
+            held, available = carts.hold(session['cart_id'], WHEEL_FILE, wheel_name, qty)
+            if not held:
+                return f"Only {available} wheel in stock", 'warning', [(WHEEL_FILE, wheel_name)]
+            item_name = f"Wheel Change ({wheel_name})"
+            cart['items'].append({'name': item_name, 'price': wheel.price, 'quantity': qty})
+            save_cart(cart)
+            return 'Added wheel change to receipt', 'success', [(WHEEL_FILE, wheel_name)]
+
+    elif action == 'add_service':
+        service_name = form.get('service_name', 'Service Charge').strip()
+        try:
+            price = float(form.get('service_price', 0))
+        except ValueError:
+            return 'Invalid service price', 'danger', []
+        if price <= 0:
+            return 'Service price must be positive', 'warning', []
+        # mark services with prefix 'Service' - won't affect stock
+        cart['items'].append({'name': f"Service: {service_name}", 'price': price, 'quantity': 1})
+        save_cart(cart)
+        return 'Added service charge to receipt', 'success', []
+
+    elif action == 'add_used_part':
+        part_name = form.get('part_name', 'قطعة مستعملة').strip()
+        try:
+            price = float(form.get('part_price', 0))
+        except ValueError:
+            return 'Invalid part price', 'danger', []
+        if price <= 0:
+            return 'Part price must be positive', 'warning', []
+        # mark used parts as 'Used Part: ...' - won't affect stock
+        cart['items'].append({'name': f"Used Part: {part_name}", 'price': price, 'quantity': 1})
+        save_cart(cart)
+        return 'Added used part to receipt', 'success', []
+
+    elif action in FINALIZE_ACTIONS:
+        ledger, label = FINALIZE_ACTIONS[action]
+        if not cart['items']:
+            return 'Receipt empty', 'warning', []
+        customer_name = form.get('customer_name','').strip()
+        if ledger != 'sales' and not customer_name:
+            return f"Customer name required for {'credit' if ledger == 'debts' else label}", 'warning', []
+        rid = cart['receipt_id']
+        targets = [t for t in (stock_target(i['name']) for i in cart['items']) if t]
+        needed = {(f, name): qty for f, per_file in receipt_stock_changes(cart['items']).items()
+                  for name, qty in per_file.items()}
+        short = carts.confirm(session['cart_id'], needed)
+        if short:
+            return 'Not enough stock: ' + ', '.join(f"only {max(0, available)} {name} left"
+                                                    for (_, name), available in short.items()), 'warning', targets
+        log_receipt(ledger, cart['items'], rid, customer_name if ledger != 'sales' else None)
+        cart['items'] = []
+        cart['receipt_id'] = new_receipt_id()
+        save_cart(cart)
+        carts.release(session['cart_id'])
+        return f"Saved Receipt #{rid} ({label})", 'success', targets
+
+    return None, None, []
+
+def remove_cart_item(cart, index):
+    """Drop a receipt line and its stock hold; returns (message, category, stock targets touched)"""
+    if not 0 <= index < len(cart['items']):
+        return 'Invalid item index', 'danger', []
+    removed = cart['items'].pop(index)
+    save_cart(cart)
+    target = stock_target(removed['name'])
+    if target:
+        carts.release(session['cart_id'], *target, int(removed['quantity']))
+    return f"Removed {removed['name']} x{removed['quantity']}", 'info', [target] if target else []
+
 @app.route('/pos', methods=['GET', 'POST'])
 def pos():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    if 'receipt_items' not in session:
-        session['receipt_items'] = []
-        session['receipt_id'] = datetime.now().strftime("%Y%m%d%H%M%S")
+    cart = current_cart()
 
     if request.method == 'POST':
-        action = request.form.get('action')
-
-        if action == 'add_product':
-            product_name = request.form.get('product_name')
-            try:
-                qty = int(request.form.get('quantity',1))
-            except:
-                qty = 1
-            product = next((p for p in get_products() if p['name'] == product_name), None)
-            if product:
-                available = get_available_stock(PRODUCT_FILE, product_name, 'product')
-                if qty > available:
-                    flash(f"Only {available} available in stock", 'warning')
-                else:
-                    session['receipt_items'].append({'name': product_name, 'price': product['price'], 'quantity': qty})
-                    session.modified = True
-                    flash('Added product to receipt', 'success')
-
-        elif action == 'add_oil':
-            oil_name = request.form.get('oil_name')
-            try:
-                qty = int(request.form.get('quantity',1))
-            except:
-                qty = 1
-            oil = next((o for o in get_oils() if o['name'] == oil_name), None)
-            if oil:
-                available = get_available_stock(OIL_FILE, oil_name, 'oil')
-                if qty > available:
-                    flash(f"Only {available} oil in stock", 'warning')
-                else:
-                    item_name = f"Oil Change ({oil_name})"
-                    session['receipt_items'].append({'name': item_name, 'price': oil['price'], 'quantity': qty})
-                    session.modified = True
-                    flash('Added oil change to receipt', 'success')
-
-        elif action == 'add_wheel':
-            wheel_name = request.form.get('wheel_name')
-            try:
-                qty = int(request.form.get('quantity',1))
-            except:
-                qty = 1
-            wheel = next((w for w in get_wheels() if w['name'] == wheel_name), None)
-            if wheel:
-                available = get_available_stock(WHEEL_FILE, wheel_name, 'wheel')
-                if qty > available:
-                    flash(f"Only {available} wheel in stock", 'warning')
-                else:
-                    item_name = f"Wheel Change ({wheel_name})"
-                    session['receipt_items'].append({'name': item_name, 'price': wheel['price'], 'quantity': qty})
-                    session.modified = True
-                    flash('Added wheel change to receipt', 'success')
-
-        elif action == 'add_service':
-            service_name = request.form.get('service_name', 'Service Charge').strip()
-            try:
-                price = float(request.form.get('service_price', 0))
-                if price <= 0:
-                    flash('Service price must be positive', 'warning')
-                else:
-                    # mark services with prefix 'Service' - won't affect stock
-                    session['receipt_items'].append({'name': f"Service: {service_name}", 'price': price, 'quantity': 1})
-                    session.modified = True
-                    flash('Added service charge to receipt', 'success')
-            except ValueError:
-                flash('Invalid service price', 'danger')
-
-        elif action == 'add_used_part':
-            part_name = request.form.get('part_name', 'قطعة مستعملة').strip()
-            try:
-                price = float(request.form.get('part_price', 0))
-                if price <= 0:
-                    flash('Part price must be positive', 'warning')
-                else:
-                    # mark used parts as 'Used Part: ...' - won't affect stock
-                    session['receipt_items'].append({'name': f"Used Part: {part_name}", 'price': price, 'quantity': 1})
-                    session.modified = True
-                    flash('Added used part to receipt', 'success')
-            except ValueError:
-                flash('Invalid part price', 'danger')
-
-        elif action == 'finalize_cash':
-            if not session.get('receipt_items'):
-                flash('Receipt empty', 'warning')
-            else:
-                rid = session.get('receipt_id')
-                log_sale(session['receipt_items'], rid)
-                session['receipt_items'] = []
-                session['receipt_id'] = datetime.now().strftime("%Y%m%d%H%M%S")
-                session.modified = True
-                flash(f"Saved Receipt #{rid} (Cash)", 'success')
-
-        elif action == 'finalize_credit':
-            if not session.get('receipt_items'):
-                flash('Receipt empty', 'warning')
-            else:
-                customer_name = request.form.get('customer_name','').strip()
-                if not customer_name:
-                    flash('Customer name required for credit', 'warning')
-                else:
-                    rid = session.get('receipt_id')
-                    log_credit(session['receipt_items'], rid, customer_name)
-                    session['receipt_items'] = []
-                    session['receipt_id'] = datetime.now().strftime("%Y%m%d%H%M%S")
-                    session.modified = True
-                    flash(f"Saved Receipt #{rid} (Credit)", 'success')
-
-        elif action == 'finalize_medgulf':
-            if not session.get('receipt_items'):
-                flash('Receipt empty', 'warning')
-            else:
-                customer_name = request.form.get('customer_name','').strip()
-                if not customer_name:
-                    flash('Customer name required for MedGulf', 'warning')
-                else:
-                    rid = session.get('receipt_id')
-                    log_medgulf(session['receipt_items'], rid, customer_name)
-                    session['receipt_items'] = []
-                    session['receipt_id'] = datetime.now().strftime("%Y%m%d%H%M%S")
-                    session.modified = True
-                    flash(f"Saved Receipt #{rid} (MedGulf)", 'success')
-
+        message, category, _ = cart_action(cart, request.form.get('action'), request.form)
+        if message:
+            flash(message, category)
         return redirect(url_for('pos'))
 
-    total = sum(float(i['price']) * int(i['quantity']) for i in session.get('receipt_items', []))
+    total = sum(float(i['price']) * int(i['quantity']) for i in cart['items'])
+    product_total, page = search_catalog(request.args.get('q', ''), [PRODUCT_FILE], limit=CATALOG_PAGE_SIZE)
     return render_template('pos.html',
-                           products=get_products(),
+                           products=[it.to_dict() for _, it in page],
+                           product_total=product_total,
+                           page_size=CATALOG_PAGE_SIZE,
                            oils=get_oils(),
                            wheels=get_wheels(),
-                           receipt_items=session.get('receipt_items', []),
+                           receipt_items=cart['items'],
                            total=total,
-                           receipt_id=session.get('receipt_id'),
+                           receipt_id=cart['receipt_id'],
                            role=session.get('role'),
                            shop_name='Salimco Motorcycle Shop')
 
 @app.route('/remove_from_cart/<int:index>', methods=['POST'])
 def remove_from_cart(index):
-    items = session.get('receipt_items', [])
-    if 0 <= index < len(items):
-        removed = items.pop(index)
-        session['receipt_items'] = items
-        session.modified = True
-        flash(f"Removed {removed['name']} x{removed['quantity']}", 'info')
-    else:
-        flash('Invalid item index', 'danger')
+    flash(*remove_cart_item(current_cart(), index)[:2])
     return redirect(url_for('pos'))
 
+# JSON API: the same cart actions for pos.html to call without a page reload.
+# Responses carry the cart and the stock of the items the action touched.
+
+def cart_view(cart):
+    items = [dict(i, index=n) for n, i in enumerate(cart['items'])]
+    return {'receipt_id': cart['receipt_id'], 'items': items,
+            'total': round(sum(float(i['price']) * int(i['quantity']) for i in items), 2)}
+
+def stock_view(file_path, name):
+    return {'catalog': CATALOG_KINDS[file_path], 'name': name, 'stock': get_stock_from_file(file_path, name),
+            'available': get_available_stock(file_path, name)}
+
+def api_result(cart, message, category, targets):
+    ok = category in ('success', 'info')
+    if message is None:
+        message, category = 'Item not found', 'warning'
+    body = {'ok': ok, 'message': message, 'category': category, 'cart': cart_view(cart),
+            'stock': [stock_view(*t) for t in dict.fromkeys(targets)]}
+    return jsonify(body), 200 if ok else 400
+
+@app.route('/api/cart', methods=['GET', 'POST'])
+def api_cart():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    cart = current_cart()
+    if request.method == 'GET':
+        return jsonify({'cart': cart_view(cart)})
+    data = request.get_json(silent=True) or request.form
+    return api_result(cart, *cart_action(cart, data.get('action'), data))
+
+@app.route('/api/cart/<int:index>', methods=['DELETE'])
+def api_remove_from_cart(index):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    cart = current_cart()
+    return api_result(cart, *remove_cart_item(cart, index))
+
+@app.route('/api/stock/<kind>/<path:name>')
+def api_stock(kind, name):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    if kind not in CATALOG_FILES:
+        return jsonify({'error': f"unknown catalog '{kind}'"}), 404
+    return jsonify(stock_view(CATALOG_FILES[kind], name))
+
+@app.route('/api/catalog/search')
+def api_catalog_search():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    kinds = [k for k in request.args.get('catalog', '').split(',') if k]
+    if any(k not in CATALOG_FILES for k in kinds):
+        return jsonify({'error': f"unknown catalog in '{request.args['catalog']}'"}), 400
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', CATALOG_PAGE_SIZE, type=int), 1), CATALOG_PAGE_MAX)
+    total, page = search_catalog(request.args.get('q', ''), [CATALOG_FILES[k] for k in kinds] or None, offset, limit)
+    end = offset + len(page)
+    return jsonify({'total': total, 'offset': offset, 'limit': limit,
+                    'next_offset': end if end < total else None,
+                    'results': [dict(it.to_dict(), catalog=CATALOG_KINDS[fp]) for fp, it in page]})
+
 @app.route('/inventory', methods=['GET', 'POST'])
 def inventory():
     if 'username' not in session or session.get('role') != 'admin':
@@ -768,10 +2789,7 @@ def inventory():
                 stock = int(request.form.get('stock',0))
             except:
                 stock = 0
-            wb = load_workbook(PRODUCT_FILE)
-            ws = wb.active
-            ws.append([name, buy_price, sell_price, stock])
-            wb.save(PRODUCT_FILE)
+            storage.add_catalog_item(PRODUCT_FILE, name, buy_price, sell_price, stock)
             flash(f"Product '{name}' added", 'success')
 
         elif action == 'add_oil':
@@ -788,10 +2806,7 @@ def inventory():
                 stock = int(request.form.get('stock',0))
             except:
                 stock = 0
-            wb = load_workbook(OIL_FILE)
-            ws = wb.active
-            ws.append([name, buy_price, sell_price, stock])
-            wb.save(OIL_FILE)
+            storage.add_catalog_item(OIL_FILE, name, buy_price, sell_price, stock)
             flash(f"Oil '{name}' added", 'success')
 
         elif action == 'add_wheel':
@@ -808,12 +2823,26 @@ def inventory():
                 stock = int(request.form.get('stock',0))
             except:
                 stock = 0
-            wb = load_workbook(WHEEL_FILE)
-            ws = wb.active
-            ws.append([name, buy_price, sell_price, stock])
-            wb.save(WHEEL_FILE)
+            storage.add_catalog_item(WHEEL_FILE, name, buy_price, sell_price, stock)
             flash(f"Wheel '{name}' added", 'success')
 
+        elif action == 'import':
+            file_path = CATALOG_FILES.get(request.form.get('catalog'))
+            upload = request.files.get('file')
+            if file_path is None or not upload or not upload.filename:
+                flash('Choose a catalog and a .csv or .xlsx file to import', 'warning')
+                return redirect(url_for('inventory'))
+            try:
+                items, errors = parse_catalog_upload(upload)
+            except Exception as e:
+                items, errors = {}, [f"Could not read {upload.filename}: {str(e)}"]
+            if items:
+                storage.upsert_catalog_items(file_path, items)
+                flash(f"Imported {len(items)} {CATALOG_KINDS[file_path]} items", 'success')
+            if errors:
+                more = f" (and {len(errors) - IMPORT_MAX_ERRORS} more)" if len(errors) > IMPORT_MAX_ERRORS else ''
+                flash(f"Skipped {len(errors)} rows: " + '; '.join(errors[:IMPORT_MAX_ERRORS]) + more, 'warning')
+
         return redirect(url_for('inventory'))
 
     products = get_products()
@@ -821,9 +2850,11 @@ def inventory():
     wheels = get_wheels()
 
     if q:
-        products = [p for p in products if q in p['name'].lower()]
-        oils = [o for o in oils if q in o['name'].lower()]
-        wheels = [w for w in wheels if q in w['name'].lower()]
+        index = catalog_index()
+        found = {index.entries[n] for n in index.search(q)}
+        products = [p for p in products if (PRODUCT_FILE, p['name']) in found]
+        oils = [o for o in oils if (OIL_FILE, o['name']) in found]
+        wheels = [w for w in wheels if (WHEEL_FILE, w['name']) in found]
 
     return render_template('inventory.html',
                            products=products,
@@ -832,11 +2863,108 @@ def inventory():
                            q=q,
                            shop_name='Salimco Motorcycle Shop')
 
+@app.route('/inventory/export/<kind>')
+def inventory_export(kind):
+    if 'username' not in session or session.get('role') != 'admin':
+        flash('Access denied', 'danger')
+        return redirect(url_for('pos'))
+    if kind not in CATALOG_FILES:
+        flash(f"Unknown catalog '{kind}'", 'danger')
+        return redirect(url_for('inventory'))
+    file_path = CATALOG_FILES[kind]
+    rows = ((it.name, it.buy_price, it.price, it.stock) for it in storage.catalog_items(file_path))
+    filename = f"{kind}s_{datetime.now().strftime('%Y-%m-%d')}"
+    if request.args.get('format') == 'csv':
+        return csv_response(filename + '.csv', CATALOG_HEADERS[file_path], rows)
+    return xlsx_response(filename + '.xlsx', CATALOG_HEADERS[file_path], rows)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target: admins, or a scraper sending POS_METRICS_TOKEN as a bearer token"""
+    bearer = request.headers.get('Authorization', '')
+    if session.get('role') != 'admin' and not (METRICS_TOKEN and bearer == f"Bearer {METRICS_TOKEN}"):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    flush_metrics(force=True)
+    return Response(merged_metrics().render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/export/<ledger>')
+def export_ledger(ledger):
+    """Ledger rows over ?since=&until= (inclusive dates, live and archived months) as xlsx or ?format=csv"""
+    if 'username' not in session or session.get('role') != 'admin':
+        flash('Access denied', 'danger')
+        return redirect(url_for('pos'))
+    if ledger not in LEDGER_HEADERS:
+        flash(f"Unknown ledger '{ledger}'", 'danger')
+        return redirect(url_for('dashboard'))
+    since, until = request.args.get('since', '').strip(), request.args.get('until', '').strip()
+    try:
+        bounds = export_range(since, until)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('dashboard'))
+    filename = f"{ledger}_{since or 'start'}_{until or datetime.now().strftime('%Y-%m-%d')}"
+    rows = storage.iter_ledger(ledger, *bounds)
+    if request.args.get('format') == 'csv':
+        return csv_response(filename + '.csv', LEDGER_HEADERS[ledger], rows)
+    return xlsx_response(filename + '.xlsx', LEDGER_HEADERS[ledger], rows)
+
+@app.route('/inventory/reorder')
+def inventory_reorder():
+    if 'username' not in session or session.get('role') != 'admin':
+        flash('Access denied', 'danger')
+        return redirect(url_for('pos'))
+    window = min(max(request.args.get('window', REORDER_WINDOW_DAYS, type=int), 1), VELOCITY_DAYS)
+    rows = reorder_suggestions(window)
+    if request.args.get('format') == 'csv':
+        headers = ['Type', 'Item', 'Stock', 'Units/Day', 'Days of Cover', 'Suggested Order']
+        return csv_response(f"reorder_{datetime.now().strftime('%Y-%m-%d')}.csv", headers,
+                            ([r['kind'], r['name'], r['stock'], r['units_per_day'], r['days_of_cover'], r['suggested_qty']]
+                             for r in rows))
+    return render_template('reorder.html', rows=rows, window=window, max_window=VELOCITY_DAYS,
+                           lead_days=REORDER_LEAD_DAYS, target_days=REORDER_TARGET_DAYS,
+                           shop_name='Salimco Motorcycle Shop')
+
+@app.route('/dashboard')
+def dashboard():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    return render_template('dashboard.html', summary=dashboard_summary(), shop_name='Salimco Motorcycle Shop')
+
+@app.route('/dashboard.json')
+def dashboard_json():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    return jsonify(dashboard_summary())
+
+@app.route('/customers')
+def customer_lookup():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    name = request.args.get('name', '').strip()
+    return redirect(url_for('customer_page', name=name) if name else url_for('dashboard'))
+
+@app.route('/customers/<path:name>')
+def customer_page(name):
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    customer = customer_index().lookup(name)
+    return render_template('customer.html', name=name, customer=customer,
+                           shop_name='Salimco Motorcycle Shop'), 200 if customer else 404
+
+@app.route('/api/customers')
+def api_customers():
+    """Customer name suggestions (with balances) for ?q=, plus the exact match if there is one"""
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    q = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', CUSTOMER_SUGGESTIONS, type=int), 1), CATALOG_PAGE_MAX)
+    index = customer_index()
+    return jsonify({'match': index.lookup(q) if q else None, 'results': index.complete(q, limit)})
+
 @app.route('/report/daily')
 def report_daily():
     try:
-        filename = generate_daily_word_report()
-        return send_file(filename, as_attachment=True)
+        return send_report('daily', datetime.now().strftime("%Y-%m-%d"), generate_daily_word_report)
     except Exception as e:
         flash(f"Error generating daily report: {str(e)}", "danger")
         return redirect(url_for('pos'))
@@ -844,9 +2972,7 @@ def report_daily():
 @app.route('/report/debts')
 def report_debts():
     try:
-        archive_old_files()
-        filename = generate_debts_word_report()
-        return send_file(filename, as_attachment=True)
+        return send_report('debts', datetime.now().strftime("%Y-%m"), generate_debts_word_report)
     except Exception as e:
         flash(f"Error generating debts report: {str(e)}", "danger")
         return redirect(url_for('pos'))
@@ -854,14 +2980,63 @@ def report_debts():
 @app.route('/report/medgulf')
 def report_medgulf():
     try:
-        archive_old_files()
-        filename = generate_medgulf_word_report()
-        return send_file(filename, as_attachment=True)
+        return send_report('medgulf', datetime.now().strftime("%Y-%m"), generate_medgulf_word_report)
     except Exception as e:
         flash(f"Error generating MedGulf report: {str(e)}", "danger")
         return redirect(url_for('pos'))
 
+@app.route('/report/yearly/<ledger>/<int:year>')
+def report_yearly(ledger, year):
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    if ledger not in YEARLY_TITLES:
+        flash(f"Unknown report '{ledger}'", "danger")
+        return redirect(url_for('pos'))
+    try:
+        return send_report(f"{ledger}-yearly", str(year), lambda: generate_yearly_word_report(ledger, str(year)))
+    except Exception as e:
+        flash(f"Error generating yearly report: {str(e)}", "danger")
+        return redirect(url_for('pos'))
+
+@app.route('/report/jobs', methods=['POST'])
+def submit_report_job_route():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    kind = (request.get_json(silent=True) or request.form).get('kind')
+    if kind not in REPORT_GENERATORS:
+        return jsonify({'error': f"unknown report '{kind}'"}), 400
+    return jsonify(report_job_view(submit_report_job(kind))), 202
+
+@app.route('/report/jobs/<job_id>')
+def report_job_status(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    job = load_report_job(job_id)
+    if job is None:
+        return jsonify({'error': 'no such job'}), 404
+    return jsonify(report_job_view(job))
+
+@app.route('/report/jobs/<job_id>/download')
+def report_job_download(job_id):
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    job = load_report_job(job_id)
+    if job is None or job['status'] != 'done':
+        flash('Report is not ready', 'warning')
+        return redirect(url_for('pos'))
+    stamp_file = report_stamp_file(job['kind'])
+    with file_lock(stamp_file):  # see send_report
+        if not os.path.exists(job['path']):
+            flash('Report is not ready', 'warning')
+            return redirect(url_for('pos'))
+        stamp = _load_json(stamp_file) if os.path.exists(stamp_file) else {}
+        # A later build may have rewritten the file; only the stamp knows its version
+        version = stamp['version'] if stamp.get('path') == job['path'] else False
+        f = open(job['path'], 'rb')
+    return send_file(f, as_attachment=True, download_name=os.path.basename(job['path']), etag=version,
+                     conditional=True)
+
 if __name__ == '__main__':
-    ensure_files()
-    archive_old_files()
+    maintenance.prepare()
+    maintenance.start()
     app.run(host='0.0.0.0', port=5000, debug=False)